@@ -0,0 +1,135 @@
+import asyncio
+from collections import OrderedDict, deque
+from typing import Any, Callable, Deque, Dict, List, Mapping
+
+from .actions_config import conf_int
+
+
+class AdmissionRejected(Exception):
+    pass
+
+
+class AdmissionTicket:
+    def __init__(self, user_id: str, group_key: str):
+        self.user_id = user_id
+        self.group_key = group_key
+        self.admitted = False
+        self.position = 0
+        self.future: asyncio.Future | None = None
+
+
+class AdmissionScheduler:
+    def __init__(self, conf: Mapping[str, Any], capacity_hint: Callable[[], int | None] | None = None):
+        self.conf = conf
+        self.capacity_hint = capacity_hint
+        self.running = 0
+        self.queued = 0
+        self.user_inflight: Dict[str, int] = {}
+        self.queues: "OrderedDict[str, OrderedDict[str, Deque[AdmissionTicket]]]" = OrderedDict()
+
+    def capacity(self) -> int:
+        capacity = conf_int(self.conf, "max_concurrent_generations", 8, minimum=1)
+        hint = self.capacity_hint() if self.capacity_hint else None
+        if hint is not None:
+            capacity = min(capacity, max(1, hint))
+        return capacity
+
+    def enter(
+        self, user_id: str, group_id: str | None, exempt: bool = False, overflow: bool = False
+    ) -> AdmissionTicket:
+        inflight = self.user_inflight.get(user_id, 0)
+        per_user = conf_int(self.conf, "max_inflight_per_user", 2, minimum=1)
+        if not exempt and inflight >= per_user:
+            raise AdmissionRejected(f"您已有 {inflight} 个请求正在处理，请等待完成后再试。")
+        ticket = AdmissionTicket(user_id, f"group:{group_id}" if group_id else f"user:{user_id}")
+        if self.running < self.capacity() and not self.queued:
+            ticket.admitted = True
+            self.running += 1
+        else:
+            if not overflow and self.queued >= conf_int(self.conf, "max_queue_size", 50, minimum=0):
+                raise AdmissionRejected("当前排队请求已满，请稍后再试。")
+            ticket.future = asyncio.get_running_loop().create_future()
+            self.queues.setdefault(ticket.group_key, OrderedDict()).setdefault(user_id, deque()).append(ticket)
+            self.queued += 1
+            ticket.position = self._position(ticket)
+        self.user_inflight[user_id] = inflight + 1
+        return ticket
+
+    async def wait(self, ticket: AdmissionTicket) -> None:
+        if ticket.admitted:
+            return
+        try:
+            await ticket.future
+        except asyncio.CancelledError:
+            self._discard(ticket)
+            raise
+
+    def release(self, ticket: AdmissionTicket) -> None:
+        if ticket.admitted:
+            ticket.admitted = False
+            self.running -= 1
+        else:
+            self._discard(ticket)
+        remaining = self.user_inflight.get(ticket.user_id, 0) - 1
+        if remaining > 0:
+            self.user_inflight[ticket.user_id] = remaining
+        else:
+            self.user_inflight.pop(ticket.user_id, None)
+        self._dispatch()
+
+    def _discard(self, ticket: AdmissionTicket) -> None:
+        users = self.queues.get(ticket.group_key)
+        tickets = users.get(ticket.user_id) if users else None
+        if tickets and ticket in tickets:
+            tickets.remove(ticket)
+            self.queued -= 1
+            if not tickets:
+                del users[ticket.user_id]
+            if not users:
+                del self.queues[ticket.group_key]
+
+    def _dispatch(self) -> None:
+        while self.queued and self.running < self.capacity():
+            ticket = self._pop_next()
+            if ticket.future.done():
+                continue
+            ticket.admitted = True
+            self.running += 1
+            ticket.future.set_result(None)
+
+    def _pop_next(self) -> AdmissionTicket:
+        group_key, users = next(iter(self.queues.items()))
+        user_id, tickets = next(iter(users.items()))
+        ticket = tickets.popleft()
+        self.queued -= 1
+        if tickets:
+            users.move_to_end(user_id)
+        else:
+            del users[user_id]
+        if users:
+            self.queues.move_to_end(group_key)
+        else:
+            del self.queues[group_key]
+        return ticket
+
+    def _position(self, target: AdmissionTicket) -> int:
+        groups: List[List[List[AdmissionTicket]]] = [
+            [list(tickets) for tickets in users.values()] for users in self.queues.values()
+        ]
+        position = 0
+        while groups:
+            users = groups.pop(0)
+            tickets = users.pop(0)
+            position += 1
+            if tickets.pop(0) is target:
+                return position
+            if tickets:
+                users.append(tickets)
+            if users:
+                groups.append(users)
+        return position
+
+    def describe_wait(self, ticket: AdmissionTicket) -> str:
+        if ticket.admitted or not ticket.position:
+            return ""
+        return f"（排队中，第 {ticket.position} 位）"
@@ -0,0 +1,184 @@
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Mapping, Tuple
+
+import aiohttp
+
+from astrbot import logger
+from astrbot.core.platform.astr_message_event import AstrMessageEvent
+
+from .actions_config import conf_float, conf_int
+from .actions_generate import LatencyWindow
+
+BACKEND_TYPES = ("volcengine", "openai")
+BREAKER_STATE_TEXT = {"closed": "正常", "open": "熔断", "half_open": "半开探测"}
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, conf: Mapping[str, Any]):
+        self.name = name
+        self.conf = conf
+        self.state = "closed"
+        self.outcomes: Deque[Tuple[float, bool]] = deque()
+        self.opened_at = 0.0
+        self.probing = False
+        self.trips = 0
+        self.last_error: str | None = None
+
+    def _trim(self, now: float) -> None:
+        window = conf_float(self.conf, "breaker_window_seconds", 60.0, minimum=1.0)
+        while self.outcomes and now - self.outcomes[0][0] > window:
+            self.outcomes.popleft()
+
+    def error_rate(self, now: float) -> float:
+        self._trim(now)
+        if not self.outcomes:
+            return 0.0
+        return sum(1 for _, ok in self.outcomes if not ok) / len(self.outcomes)
+
+    def allow(self, now: float) -> bool:
+        if self.state == "open":
+            if now - self.opened_at < conf_float(self.conf, "breaker_open_seconds", 30.0, minimum=1.0):
+                return False
+            self.state = "half_open"
+            self.probing = False
+        if self.state == "half_open":
+            if self.probing:
+                return False
+            self.probing = True
+        return True
+
+    def record(self, ok: bool, latency: float, now: float, error: str | None = None) -> None:
+        slow_after = conf_float(self.conf, "breaker_slow_seconds", 0.0, minimum=0.0)
+        healthy = ok and not (slow_after and latency > slow_after)
+        if not healthy:
+            self.last_error = error or f"响应过慢 ({latency:.1f}s)"
+        if self.state == "half_open":
+            self.probing = False
+            if healthy:
+                self.state = "closed"
+                self.outcomes.clear()
+                logger.info(f"后端 {self.name} 探测成功，熔断器已关闭")
+            else:
+                self._open(now)
+            return
+        self.outcomes.append((now, healthy))
+        if healthy:
+            return
+        min_requests = conf_int(self.conf, "breaker_min_requests", 5, minimum=1)
+        threshold = conf_float(self.conf, "breaker_error_rate", 0.5, minimum=0.0)
+        if len(self.outcomes) >= min_requests and self.error_rate(now) >= threshold:
+            self._open(now)
+
+    def cancel_probe(self) -> None:
+        if self.state == "half_open":
+            self.probing = False
+
+    def _open(self, now: float) -> None:
+        self.state = "open"
+        self.opened_at = now
+        self.trips += 1
+        self.outcomes.clear()
+        logger.warning(f"后端 {self.name} 熔断器打开: {self.last_error}")
+
+    def describe(self, now: float) -> str:
+        self._trim(now)
+        parts = [f"状态: {BREAKER_STATE_TEXT[self.state]}"]
+        if self.state == "open":
+            remaining = conf_float(self.conf, "breaker_open_seconds", 30.0, minimum=1.0) - (now - self.opened_at)
+            parts.append(f"{max(0.0, remaining):.0f}s 后探测")
+        parts.append(f"近期请求 {len(self.outcomes)} 次, 错误率 {self.error_rate(now) * 100:.0f}%")
+        parts.append(f"累计熔断 {self.trips} 次")
+        if self.last_error:
+            parts.append(f"最近错误: {self.last_error[:40]}")
+        return " | ".join(parts)
+
+
+class AdaptiveTimeouts:
+    def __init__(self, conf: Mapping[str, Any]):
+        self.conf = conf
+        self.windows: Dict[Tuple[str, str, str], Tuple[LatencyWindow, LatencyWindow]] = {}
+
+    def _windows(self, key: Tuple[str, str, str]) -> Tuple[LatencyWindow, LatencyWindow]:
+        if key not in self.windows:
+            min_samples = conf_int(self.conf, "api_timeout_min_samples", 20, minimum=1)
+            self.windows[key] = (LatencyWindow(min_samples=min_samples), LatencyWindow(min_samples=min_samples))
+        return self.windows[key]
+
+    def observe(self, key: Tuple[str, str, str], first_byte: float, total: float) -> None:
+        first_byte_window, total_window = self._windows(key)
+        first_byte_window.add(first_byte)
+        total_window.add(total)
+
+    def _derive(self, window: LatencyWindow) -> float | None:
+        p99 = window.percentile(0.99)
+        if p99 is None:
+            return None
+        factor = conf_float(self.conf, "api_timeout_factor", 2.0, minimum=1.0)
+        floor = conf_float(self.conf, "api_timeout_min", 15.0, minimum=1.0)
+        ceiling = conf_float(self.conf, "api_timeout_max", 300.0, minimum=floor)
+        return min(ceiling, max(floor, p99 * factor))
+
+    def timeouts(self, key: Tuple[str, str, str]) -> Dict[str, float]:
+        first_byte_window, total_window = self._windows(key)
+        default = conf_float(self.conf, "api_timeout_default", 120.0, minimum=1.0)
+        total = self._derive(total_window) or default
+        first_byte = min(total, self._derive(first_byte_window) or total)
+        connect = min(first_byte, conf_float(self.conf, "api_connect_timeout", 10.0, minimum=1.0))
+        return {"connect": connect, "first_byte": first_byte, "total": total}
+
+    def client_timeout(self, key: Tuple[str, str, str]) -> aiohttp.ClientTimeout:
+        values = self.timeouts(key)
+        return aiohttp.ClientTimeout(total=values["total"], sock_connect=values["connect"])
+
+    def describe(self) -> List[str]:
+        lines = []
+        for key in self.windows:
+            values = self.timeouts(key)
+            total_window = self.windows[key][1]
+            p50 = total_window.percentile(0.5)
+            observed = f"p50 {p50:.1f}s" if p50 is not None else "样本不足"
+            lines.append(
+                f"{'/'.join(key)}: 连接 {values['connect']:.0f}s, 首字节 {values['first_byte']:.0f}s, "
+                f"总计 {values['total']:.0f}s ({len(total_window.samples)} 样本, {observed})"
+            )
+        return lines
+
+
+class BackendRouter:
+    def __init__(self, conf: Mapping[str, Any]):
+        self.conf = conf
+        self.breakers: Dict[str, CircuitBreaker] = {name: CircuitBreaker(name, conf) for name in BACKEND_TYPES}
+        self.timeouts = AdaptiveTimeouts(conf)
+
+    def chain(self) -> List[str]:
+        order = [self.conf.get("api_type", "openai"), *(self.conf.get("fallback_api_types") or [])]
+        return [name for name in dict.fromkeys(order) if name in BACKEND_TYPES]
+
+    def breaker(self, name: str) -> CircuitBreaker:
+        return self.breakers[name]
+
+    def describe(self) -> List[str]:
+        now = time.monotonic()
+        chain = self.chain()
+        lines = []
+        for name in chain:
+            role = "主后端" if name == chain[0] else "备用"
+            lines.append(f"{name} ({role})\n   {self.breakers[name].describe(now)}")
+        return lines
+
+
+async def backend_status(plugin, event: AstrMessageEvent):
+    if not plugin.is_global_admin(event):
+        return
+    generation = plugin.generation
+    lines = ["🔌 后端状态", *plugin.backends.describe()]
+    lines.append(f"生成重试: {generation.retries} 次, 对冲请求: {generation.hedges} 次 (对冲胜出 {generation.hedge_wins})")
+    first_url = generation.stream_first_url.percentile(0.5)
+    if first_url is not None:
+        lines.append(f"流式首个图片 URL: p50 {first_url:.2f}s, p90 {generation.stream_first_url.percentile(0.9):.2f}s")
+    timeouts = plugin.backends.timeouts.describe()
+    if timeouts:
+        lines.append("⏱️ 自适应超时 (后端/模型/尺寸)")
+        lines.extend(timeouts)
+    yield event.plain_result("\n".join(lines))
@@ -0,0 +1,378 @@
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Dict, Generic, Hashable, Tuple, TypeVar
+
+from astrbot import logger
+from astrbot.core.platform.astr_message_event import AstrMessageEvent
+
+V = TypeVar("V")
+
+
+class LRUCache(Generic[V]):
+    def __init__(
+        self,
+        max_bytes: int,
+        sizeof: Callable[[V], int] = len,
+        on_evict: Callable[[Hashable, V], None] | None = None,
+    ):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._sizeof = sizeof
+        self._on_evict = on_evict
+        self._items: "OrderedDict[Hashable, V]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def get(self, key: Hashable) -> V | None:
+        value = self._items.get(key)
+        if value is not None:
+            self._items.move_to_end(key)
+        return value
+
+    def put(self, key: Hashable, value: V) -> None:
+        self.pop(key)
+        value_size = self._sizeof(value)
+        if value_size > self.max_bytes:
+            if self._on_evict:
+                self._on_evict(key, value)
+            return
+        self._items[key] = value
+        self.size += value_size
+        while self.size > self.max_bytes:
+            evicted_key, evicted = self._items.popitem(last=False)
+            self.size -= self._sizeof(evicted)
+            if self._on_evict:
+                self._on_evict(evicted_key, evicted)
+
+    def pop(self, key: Hashable) -> V | None:
+        value = self._items.pop(key, None)
+        if value is not None:
+            self.size -= self._sizeof(value)
+        return value
+
+
+class AvatarCache:
+    def __init__(self, cache_dir: Path | None, max_memory_bytes: int, ttl: float, max_disk_bytes: int):
+        self.ttl = ttl
+        self.memory: LRUCache[Tuple[bytes, Dict[str, Any]]] = LRUCache(
+            max_memory_bytes, sizeof=lambda entry: len(entry[0])
+        )
+        self.cache_dir = cache_dir if max_disk_bytes > 0 else None
+        self.max_disk_bytes = max_disk_bytes
+        self.disk: "OrderedDict[str, int]" = OrderedDict()
+        self.disk_size = 0
+        if self.cache_dir:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            self._scan_disk()
+
+    def _paths(self, user_id: str) -> Tuple[Path, Path]:
+        return self.cache_dir / f"{user_id}.img", self.cache_dir / f"{user_id}.json"
+
+    def _scan_disk(self) -> None:
+        entries = []
+        for path in self.cache_dir.glob("*.img"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, path.stem, stat.st_size))
+        for _, user_id, size in sorted(entries):
+            self.disk[user_id] = size
+            self.disk_size += size
+        for path in self.cache_dir.glob("*.json"):
+            if path.stem not in self.disk:
+                path.unlink(missing_ok=True)
+        self._trim_disk()
+
+    def _trim_disk(self) -> None:
+        while self.disk_size > self.max_disk_bytes and self.disk:
+            user_id, size = self.disk.popitem(last=False)
+            self.disk_size -= size
+            for path in self._paths(user_id):
+                path.unlink(missing_ok=True)
+
+    def _read_disk_sync(self, user_id: str) -> Tuple[bytes, Dict[str, Any]] | None:
+        data_path, meta_path = self._paths(user_id)
+        if not data_path.is_file() or not meta_path.is_file():
+            return None
+        meta = json.loads(meta_path.read_text("utf-8"))
+        return data_path.read_bytes(), meta
+
+    def _write_disk_sync(self, user_id: str, data: bytes | None, meta: Dict[str, Any]) -> None:
+        data_path, meta_path = self._paths(user_id)
+        if data is not None:
+            data_path.write_bytes(data)
+        meta_path.write_text(json.dumps(meta), "utf-8")
+
+    async def lookup(self, user_id: str) -> Tuple[bytes | None, bool, Dict[str, Any]]:
+        entry = self.memory.get(user_id)
+        if entry is None and self.cache_dir:
+            loop = asyncio.get_running_loop()
+            try:
+                entry = await loop.run_in_executor(None, self._read_disk_sync, user_id)
+            except Exception as e:
+                logger.warning(f"读取头像磁盘缓存失败 ({user_id}): {e}")
+                entry = None
+            if entry is not None:
+                self.memory.put(user_id, entry)
+                if user_id in self.disk:
+                    self.disk.move_to_end(user_id)
+        if entry is None:
+            return None, False, {}
+        data, meta = entry
+        fresh = time.time() - meta.get("fetched_at", 0) < self.ttl
+        return data, fresh, meta
+
+    async def store(self, user_id: str, data: bytes, etag: str | None, last_modified: str | None) -> None:
+        meta = {"etag": etag, "last_modified": last_modified, "fetched_at": time.time()}
+        self.memory.put(user_id, (data, meta))
+        await self._persist(user_id, data, meta)
+
+    async def touch(self, user_id: str, data: bytes, meta: Dict[str, Any]) -> None:
+        meta = dict(meta, fetched_at=time.time())
+        self.memory.put(user_id, (data, meta))
+        await self._persist(user_id, None if user_id in self.disk else data, meta)
+
+    async def _persist(self, user_id: str, data: bytes | None, meta: Dict[str, Any]) -> None:
+        if not self.cache_dir:
+            return
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(None, self._write_disk_sync, user_id, data, meta)
+        except Exception as e:
+            logger.warning(f"写入头像磁盘缓存失败 ({user_id}): {e}")
+            return
+        if data is not None:
+            self.disk_size += len(data) - self.disk.pop(user_id, 0)
+            self.disk[user_id] = len(data)
+            self._trim_disk()
+        elif user_id in self.disk:
+            self.disk.move_to_end(user_id)
+
+
+class ImageCache:
+    def __init__(
+        self,
+        cache_dir: Path | None,
+        max_memory_bytes: int,
+        max_disk_bytes: int,
+        max_sources: int = 4096,
+    ):
+        self.memory: LRUCache[bytes] = LRUCache(max_memory_bytes, on_evict=self._spill)
+        self.sources: "OrderedDict[str, str]" = OrderedDict()
+        self.max_sources = max_sources
+        self.cache_dir = cache_dir if max_disk_bytes > 0 else None
+        self.max_disk_bytes = max_disk_bytes
+        self.disk: "OrderedDict[str, int]" = OrderedDict()
+        self.disk_size = 0
+        self.source_hits = 0
+        self.content_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._pending_writes: set[asyncio.Future] = set()
+        if self.cache_dir:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            self._scan_disk()
+
+    def _scan_disk(self) -> None:
+        entries = []
+        for path in self.cache_dir.glob("*.bin"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, path.stem, stat.st_size))
+        for _, digest, size in sorted(entries):
+            self.disk[digest] = size
+            self.disk_size += size
+        self._trim_disk()
+
+    def _disk_path(self, digest: str) -> Path:
+        return self.cache_dir / f"{digest}.bin"
+
+    def _trim_disk(self) -> None:
+        while self.disk_size > self.max_disk_bytes and self.disk:
+            digest, size = self.disk.popitem(last=False)
+            self.disk_size -= size
+            self._disk_path(digest).unlink(missing_ok=True)
+
+    def _spill(self, digest: Hashable, data: bytes) -> None:
+        if not self.cache_dir or digest in self.disk or len(data) > self.max_disk_bytes:
+            return
+        self.disk[digest] = len(data)
+        self.disk_size += len(data)
+        path = self._disk_path(str(digest))
+        try:
+            future = asyncio.get_running_loop().run_in_executor(None, path.write_bytes, data)
+        except RuntimeError:
+            path.write_bytes(data)
+        else:
+            self._pending_writes.add(future)
+            future.add_done_callback(self._pending_writes.discard)
+        self._trim_disk()
+
+    def link(self, source: str, digest: str) -> None:
+        if source.startswith("base64://"):
+            return
+        self.sources[source] = digest
+        self.sources.move_to_end(source)
+        while len(self.sources) > self.max_sources:
+            self.sources.popitem(last=False)
+
+    async def _get(self, digest: str) -> bytes | None:
+        data = self.memory.get(digest)
+        if data is not None:
+            return data
+        if digest not in self.disk:
+            return None
+        loop = asyncio.get_running_loop()
+        try:
+            data = await loop.run_in_executor(None, self._disk_path(digest).read_bytes)
+        except OSError:
+            self.disk_size -= self.disk.pop(digest, 0)
+            return None
+        self.disk.move_to_end(digest)
+        self.disk_hits += 1
+        self.memory.put(digest, data)
+        return data
+
+    async def get_source(self, source: str) -> bytes | None:
+        digest = self.sources.get(source)
+        if digest is None:
+            return None
+        data = await self._get(digest)
+        if data is None:
+            self.sources.pop(source, None)
+            return None
+        self.sources.move_to_end(source)
+        self.source_hits += 1
+        return data
+
+    async def get_content(self, digest: str) -> bytes | None:
+        data = await self._get(digest)
+        if data is None:
+            self.misses += 1
+        else:
+            self.content_hits += 1
+        return data
+
+    async def get_derived(self, digest: str, variant: str) -> bytes | None:
+        return await self._get(f"{digest}-{variant}")
+
+    def put_derived(self, digest: str, variant: str, data: bytes) -> None:
+        self.memory.put(f"{digest}-{variant}", data)
+
+    def put(self, source: str, digest: str, data: bytes) -> None:
+        self.memory.put(digest, data)
+        self.link(source, digest)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "source_hits": self.source_hits,
+            "content_hits": self.content_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "memory_entries": len(self.memory),
+            "memory_bytes": self.memory.size,
+            "disk_entries": len(self.disk),
+            "disk_bytes": self.disk_size,
+        }
+
+
+class ResultStore:
+    def __init__(self, cache_dir: Path, max_bytes: int, max_age: float, max_urls: int = 4096):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.max_urls = max_urls
+        self.files: "OrderedDict[str, Tuple[int, float]]" = OrderedDict()
+        self.urls: "OrderedDict[str, str]" = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.stored = 0
+        self.evicted = 0
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._scan_disk()
+
+    def _scan_disk(self) -> None:
+        entries = []
+        for path in self.cache_dir.iterdir():
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, path.name, stat.st_size))
+        for mtime, name, size in sorted(entries):
+            self.files[name] = (size, mtime)
+            self.size += size
+        self._evict()
+
+    def _evict(self, keep: str | None = None) -> None:
+        now = time.time()
+        while self.files:
+            name, (size, stored_at) = next(iter(self.files.items()))
+            if name == keep or (self.size <= self.max_bytes and now - stored_at <= self.max_age):
+                break
+            del self.files[name]
+            self.size -= size
+            self.evicted += 1
+            (self.cache_dir / name).unlink(missing_ok=True)
+
+    def lookup(self, url: str) -> Path | None:
+        name = self.urls.get(url)
+        if name is None or name not in self.files:
+            return None
+        self.urls.move_to_end(url)
+        self.files[name] = (self.files[name][0], time.time())
+        self.files.move_to_end(name)
+        self.hits += 1
+        return self.cache_dir / name
+
+    async def save(self, url: str, name: str, data: bytes) -> Path | None:
+        if len(data) > self.max_bytes:
+            return None
+        path = self.cache_dir / name
+        if name not in self.files:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, path.write_bytes, data)
+            self.size += len(data)
+            self.stored += 1
+        self.files[name] = (len(data), time.time())
+        self.files.move_to_end(name)
+        self.urls[url] = name
+        self.urls.move_to_end(url)
+        while len(self.urls) > self.max_urls:
+            self.urls.popitem(last=False)
+        self._evict(keep=name)
+        return path
+
+
+async def cache_stats(plugin, event: AstrMessageEvent):
+    if not plugin.is_global_admin(event):
+        return
+    if not plugin.iwf:
+        yield event.plain_result("ImageWorkflow 未初始化")
+        return
+    stats = plugin.iwf.image_cache.stats()
+    lookups = stats["source_hits"] + stats["content_hits"] + stats["misses"]
+    hit_rate = (stats["source_hits"] + stats["content_hits"]) / lookups * 100 if lookups else 0.0
+    lines = [
+        "🗂️ 图片缓存统计",
+        f"命中率: {hit_rate:.1f}% (来源命中 {stats['source_hits']} / 内容命中 {stats['content_hits']} / 未命中 {stats['misses']})",
+        f"磁盘命中: {stats['disk_hits']}",
+        f"内存: {stats['memory_entries']} 项, {stats['memory_bytes'] / 1024 / 1024:.1f} MB",
+        f"磁盘: {stats['disk_entries']} 项, {stats['disk_bytes'] / 1024 / 1024:.1f} MB",
+        f"头像内存缓存: {len(plugin.iwf.avatar_cache.memory)} 项, {plugin.iwf.avatar_cache.memory.size / 1024 / 1024:.1f} MB",
+        f"生成结果缓存: {len(plugin.generation.results)} 项, 命中 {plugin.generation.cache_hits}, 合并请求 {plugin.generation.coalesced}",
+    ]
+    store = plugin.iwf.result_store
+    if store:
+        lines.append(
+            f"结果图片存储: {len(store.files)} 项, {store.size / 1024 / 1024:.1f} MB, "
+            f"复用 {store.hits}, 淘汰 {store.evicted}"
+        )
+    yield event.plain_result("\n".join(lines))
@@ -0,0 +1,241 @@
+import asyncio
+import base64
+import io
+import multiprocessing
+import pickle
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, TypeVar
+
+from PIL import Image as PILImage
+
+from astrbot import logger
+
+from .actions_config import conf_int
+
+MIME_SIGNATURES = (
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"BM", "image/bmp"),
+)
+NORMALIZE_FORMATS = {"JPEG", "WEBP", "PNG"}
+
+T = TypeVar("T")
+
+
+def sniff_mime(data: bytes) -> str:
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    for signature, mime in MIME_SIGNATURES:
+        if data.startswith(signature):
+            return mime
+    return "image/png"
+
+
+def data_uri(img_bytes: bytes) -> str:
+    img_b64 = base64.b64encode(img_bytes).decode("utf-8")
+    return f"data:{sniff_mime(img_bytes)};base64,{img_b64}"
+
+
+def _probe_gif(data: bytes) -> bool | None:
+    if len(data) < 13:
+        return None
+    pos = 13
+    if data[10] & 0x80:
+        pos += 3 * (2 ** ((data[10] & 0x07) + 1))
+    frames = 0
+    while pos < len(data):
+        block = data[pos]
+        if block == 0x3B:
+            return False
+        if block == 0x2C:
+            frames += 1
+            if frames > 1:
+                return True
+            if pos + 10 > len(data):
+                return None
+            packed = data[pos + 9]
+            pos += 10
+            if packed & 0x80:
+                pos += 3 * (2 ** ((packed & 0x07) + 1))
+            pos += 1
+        elif block == 0x21:
+            pos += 2
+        else:
+            return None
+        while pos < len(data) and data[pos]:
+            pos += data[pos] + 1
+        pos += 1
+    return None
+
+
+def _probe_png(data: bytes) -> bool | None:
+    pos = 8
+    while pos + 8 <= len(data):
+        length = int.from_bytes(data[pos : pos + 4], "big")
+        chunk_type = data[pos + 4 : pos + 8]
+        if chunk_type == b"acTL":
+            return int.from_bytes(data[pos + 8 : pos + 12], "big") > 1
+        if chunk_type == b"IDAT":
+            return False
+        pos += length + 12
+    return None
+
+
+def _probe_webp(data: bytes) -> bool | None:
+    chunk_type = data[12:16]
+    if chunk_type == b"VP8X" and len(data) > 20:
+        return bool(data[20] & 0x02)
+    if chunk_type in (b"VP8 ", b"VP8L"):
+        return False
+    return None
+
+
+def probe_animation(data: bytes) -> bool | None:
+    if data[:6] in (b"GIF87a", b"GIF89a"):
+        return _probe_gif(data)
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        return _probe_png(data)
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return _probe_webp(data)
+    if data[:3] == b"\xff\xd8\xff" or data[:2] == b"BM":
+        return False
+    return None
+
+
+def extract_first_frame_full(raw: bytes) -> bytes:
+    img_io = io.BytesIO(raw)
+    try:
+        with PILImage.open(img_io) as img:
+            if getattr(img, "is_animated", False):
+                logger.info("检测到动图, 将抽取第一帧进行生成")
+                img.seek(0)
+                first_frame = img.convert("RGBA")
+                out_io = io.BytesIO()
+                first_frame.save(out_io, format="PNG")
+                return out_io.getvalue()
+    except Exception as e:
+        logger.warning(f"抽取图片帧时发生错误, 将返回原始数据: {e}", exc_info=True)
+    return raw
+
+
+def extract_first_frame(raw: bytes) -> bytes:
+    if probe_animation(raw) is False:
+        return raw
+    return extract_first_frame_full(raw)
+
+
+def _profile_from(cfg: Dict[str, Any], enabled: bool, max_edge: int, max_kb: int) -> Dict[str, Any] | None:
+    if not cfg.get("enable", enabled):
+        return None
+    fmt = str(cfg.get("format", "JPEG")).upper()
+    return {
+        "max_edge": conf_int(cfg, "max_edge", max_edge, minimum=64),
+        "max_bytes": conf_int(cfg, "max_kb", max_kb, minimum=64) * 1024,
+        "fmt": fmt if fmt in NORMALIZE_FORMATS else "JPEG",
+        "quality": min(100, conf_int(cfg, "quality", 90, minimum=1)),
+    }
+
+
+def normalize_profile(conf: Dict[str, Any], api_type: str) -> Dict[str, Any] | None:
+    return _profile_from(conf.get(f"{api_type}_image_normalize") or {}, True, 2048, 3072)
+
+
+def output_profile(conf: Dict[str, Any], platform: str | None) -> Dict[str, Any] | None:
+    cfg = dict(conf.get("output_compress") or {})
+    for entry in conf.get("output_platform_budgets") or []:
+        name, _, budget = entry.partition("=")
+        edge, _, kb = budget.partition(",")
+        if platform and name.strip() == platform and edge.strip().isdigit() and kb.strip().isdigit():
+            cfg.update(max_edge=int(edge), max_kb=int(kb))
+            break
+    return _profile_from(cfg, False, 2048, 2048)
+
+
+def profile_key(profile: Dict[str, Any]) -> str:
+    return f"{profile['fmt']}-{profile['max_edge']}-{profile['max_bytes']}-{profile['quality']}"
+
+
+def _prepare_mode(img: PILImage.Image, fmt: str) -> PILImage.Image:
+    has_alpha = img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info)
+    if fmt == "JPEG":
+        if has_alpha:
+            rgba = img.convert("RGBA")
+            background = PILImage.new("RGB", rgba.size, (255, 255, 255))
+            background.paste(rgba, mask=rgba.getchannel("A"))
+            return background
+        return img.convert("RGB")
+    return img.convert("RGBA" if has_alpha else "RGB")
+
+
+def normalize_image(raw: bytes, max_edge: int, max_bytes: int, fmt: str, quality: int) -> bytes:
+    try:
+        with PILImage.open(io.BytesIO(raw)) as src:
+            if max(src.size) <= max_edge and len(raw) <= max_bytes and src.format == fmt:
+                return raw
+            img = _prepare_mode(src, fmt)
+        if max(img.size) > max_edge:
+            img.thumbnail((max_edge, max_edge), PILImage.Resampling.LANCZOS)
+        while True:
+            out_io = io.BytesIO()
+            if fmt == "PNG":
+                img.save(out_io, format=fmt, optimize=True)
+            else:
+                img.save(out_io, format=fmt, quality=quality, optimize=True)
+            data = out_io.getvalue()
+            if len(data) <= max_bytes or min(img.size) <= 256:
+                return data
+            if fmt != "PNG" and quality > 50:
+                quality -= 10
+            else:
+                img = img.resize(
+                    (max(1, int(img.width * 0.75)), max(1, int(img.height * 0.75))),
+                    PILImage.Resampling.LANCZOS,
+                )
+    except Exception as e:
+        logger.warning(f"图片规范化失败, 将使用原始数据: {e}", exc_info=True)
+        return raw
+
+
+class CodecPool:
+    def __init__(self, workers: int):
+        self.workers = workers
+        self.uses_processes = False
+        self.executor: Executor = self._create_executor()
+
+    def _create_executor(self) -> Executor:
+        if self.workers > 0:
+            try:
+                executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+                )
+                self.uses_processes = True
+                logger.info(f"图片编解码使用进程池 (workers={self.workers})")
+                return executor
+            except (OSError, NotImplementedError, ImportError) as e:
+                logger.warning(f"无法创建进程池, 图片编解码回退到线程池: {e}")
+        return ThreadPoolExecutor(max_workers=max(1, self.workers or 2), thread_name_prefix="figurine-codec")
+
+    def _fallback_to_threads(self) -> None:
+        old_executor = self.executor
+        self.uses_processes = False
+        self.workers = 0
+        self.executor = self._create_executor()
+        old_executor.shutdown(wait=False, cancel_futures=True)
+
+    async def run(self, func: Callable[..., T], *args: Any) -> T:
+        loop = asyncio.get_running_loop()
+        if not self.uses_processes:
+            return await loop.run_in_executor(self.executor, func, *args)
+        try:
+            return await loop.run_in_executor(self.executor, func, *args)
+        except (BrokenProcessPool, OSError, pickle.PicklingError) as e:
+            logger.warning(f"进程池执行失败, 图片编解码回退到线程池: {e!r}")
+            if self.uses_processes:
+                self._fallback_to_threads()
+            return await loop.run_in_executor(self.executor, func, *args)
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=False, cancel_futures=True)
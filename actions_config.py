@@ -0,0 +1,21 @@
+from typing import Any, Mapping
+
+
+def conf_int(conf: Mapping[str, Any], key: str, default: int, minimum: int | None = None) -> int:
+    try:
+        value = int(conf.get(key, default))
+    except (TypeError, ValueError):
+        value = default
+    if minimum is not None:
+        value = max(minimum, value)
+    return value
+
+
+def conf_float(conf: Mapping[str, Any], key: str, default: float, minimum: float | None = None) -> float:
+    try:
+        value = float(conf.get(key, default))
+    except (TypeError, ValueError):
+        value = default
+    if minimum is not None:
+        value = max(minimum, value)
+    return value
@@ -1,17 +1,140 @@
 import asyncio
+import csv
 import functools
+import io
 import json
 import random
 import re
-from datetime import datetime
-from typing import Optional
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
 
 from astrbot import logger
-from astrbot.core.message.components import At
+from astrbot.core.message.components import At, File
 from astrbot.core.platform.astr_message_event import AstrMessageEvent
 
+from .actions_config import conf_int
+from .actions_store import QuotaStore, SnapshotWriter, write_json_atomic
+
+
+def _open_snapshots(plugin) -> None:
+    interval = conf_int(plugin.conf, "snapshot_flush_interval_ms", 1000, minimum=0) / 1000
+    max_changes = conf_int(plugin.conf, "snapshot_flush_max_changes", 100, minimum=1)
+    plugin.snapshots = {
+        "user": SnapshotWriter(plugin.user_counts_file, lambda: plugin.user_counts, interval, max_changes),
+        "group": SnapshotWriter(plugin.group_counts_file, lambda: plugin.group_counts, interval, max_changes),
+        "checkin": SnapshotWriter(plugin.user_checkin_file, lambda: plugin.checkins.to_dict(), interval, max_changes),
+    }
+
+
+async def open_quota_store(plugin) -> None:
+    if plugin.conf.get("quota_backend", "sqlite") != "sqlite":
+        _open_snapshots(plugin)
+        return
+    path = plugin.plugin_data_dir / "quota.db"
+    existed = path.exists()
+    store = QuotaStore(path)
+    try:
+        await store.open()
+    except Exception as e:
+        await store.close()
+        if existed:
+            logger.error(f"打开 SQLite 次数数据库 {path} 失败，为避免次数数据被重置，已停止加载: {e}", exc_info=True)
+            raise
+        logger.error(f"打开 SQLite 次数数据库失败，回退到 JSON 文件存储: {e}", exc_info=True)
+        _open_snapshots(plugin)
+        return
+    plugin.quota_store = store
+
+
+async def close_quota_store(plugin) -> None:
+    for writer in plugin.snapshots.values():
+        await writer.close()
+    if plugin.quota_store:
+        await plugin.quota_store.close()
+        plugin.quota_store = None
+
+
+async def _migrate_json(path, label: str) -> dict | None:
+    if not path.exists():
+        return None
+    loop = asyncio.get_running_loop()
+    try:
+        content = await loop.run_in_executor(None, path.read_text, "utf-8")
+        data = await loop.run_in_executor(None, json.loads, content)
+    except Exception as e:
+        logger.error(f"迁移{label}文件失败，已保留原文件: {e}", exc_info=True)
+        return None
+    if not isinstance(data, dict):
+        return None
+    return {str(k): v for k, v in data.items()}
+
+
+async def _finish_migration(path, label: str, size: int) -> None:
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, path.replace, path.with_name(path.name + ".migrated"))
+    logger.info(f"已将 {size} 条{label}从 JSON 迁移到 SQLite")
+
+
+async def _load_store_counts(plugin, kind: str, path, label: str) -> dict:
+    data = await plugin.quota_store.load_counts(kind)
+    if not data:
+        migrated = await _migrate_json(path, label)
+        if migrated is not None:
+            await plugin.quota_store.set_counts(kind, migrated)
+            await _finish_migration(path, label, len(migrated))
+            data = migrated
+    return data
+
+
+async def persist_user_counts(plugin, *user_ids: str) -> None:
+    if plugin.quota_store:
+        try:
+            await plugin.quota_store.set_counts(
+                "user", {uid: plugin.user_counts.get(str(uid), 0) for uid in user_ids}
+            )
+        except Exception as e:
+            logger.error(f"保存用户次数时发生错误: {e}", exc_info=True)
+        return
+    if "user" in plugin.snapshots:
+        plugin.snapshots["user"].mark_dirty()
+        return
+    await save_user_counts(plugin)
+
+
+async def persist_group_counts(plugin, *group_ids: str) -> None:
+    if plugin.quota_store:
+        try:
+            await plugin.quota_store.set_counts(
+                "group", {gid: plugin.group_counts.get(str(gid), 0) for gid in group_ids}
+            )
+        except Exception as e:
+            logger.error(f"保存群组次数时发生错误: {e}", exc_info=True)
+        return
+    if "group" in plugin.snapshots:
+        plugin.snapshots["group"].mark_dirty()
+        return
+    await save_group_counts(plugin)
+
+
+async def persist_user_checkins(plugin, *user_ids: str) -> None:
+    if plugin.quota_store:
+        book = plugin.checkins
+        try:
+            await plugin.quota_store.set_checkins(book.day, {uid: book.today[uid] for uid in user_ids})
+        except Exception as e:
+            logger.error(f"保存用户签到数据时发生错误: {e}", exc_info=True)
+        return
+    if "checkin" in plugin.snapshots:
+        plugin.snapshots["checkin"].mark_dirty()
+        return
+    await save_user_checkin_data(plugin)
+
 
 async def load_user_counts(plugin) -> None:
+    if plugin.quota_store:
+        plugin.user_counts = await _load_store_counts(plugin, "user", plugin.user_counts_file, "用户次数")
+        return
     if not plugin.user_counts_file.exists():
         plugin.user_counts = {}
         return
@@ -33,7 +156,7 @@ async def save_user_counts(plugin) -> None:
             None,
             functools.partial(json.dumps, plugin.user_counts, ensure_ascii=False, indent=4),
         )
-        await loop.run_in_executor(None, plugin.user_counts_file.write_text, json_data, "utf-8")
+        await loop.run_in_executor(None, write_json_atomic, plugin.user_counts_file, json_data)
     except Exception as e:
         logger.error(f"保存用户次数文件时发生错误: {e}", exc_info=True)
 
@@ -42,15 +165,18 @@ def get_user_count(plugin, user_id: str) -> int:
     return plugin.user_counts.get(str(user_id), 0)
 
 
-async def decrease_user_count(plugin, user_id: str) -> None:
+async def decrease_user_count(plugin, user_id: str, amount: int = 1) -> None:
     user_id_str = str(user_id)
     count = get_user_count(plugin, user_id_str)
     if count > 0:
-        plugin.user_counts[user_id_str] = count - 1
-        await save_user_counts(plugin)
+        plugin.user_counts[user_id_str] = max(0, count - amount)
+        await persist_user_counts(plugin, user_id_str)
 
 
 async def load_group_counts(plugin) -> None:
+    if plugin.quota_store:
+        plugin.group_counts = await _load_store_counts(plugin, "group", plugin.group_counts_file, "群组次数")
+        return
     if not plugin.group_counts_file.exists():
         plugin.group_counts = {}
         return
@@ -72,7 +198,7 @@ async def save_group_counts(plugin) -> None:
             None,
             functools.partial(json.dumps, plugin.group_counts, ensure_ascii=False, indent=4),
         )
-        await loop.run_in_executor(None, plugin.group_counts_file.write_text, json_data, "utf-8")
+        await loop.run_in_executor(None, write_json_atomic, plugin.group_counts_file, json_data)
     except Exception as e:
         logger.error(f"保存群组次数文件时发生错误: {e}", exc_info=True)
 
@@ -83,27 +209,175 @@ def get_group_count(plugin, group_id: Optional[str]) -> int:
     return plugin.group_counts.get(str(group_id), 0)
 
 
-async def decrease_group_count(plugin, group_id: str) -> None:
+async def decrease_group_count(plugin, group_id: str, amount: int = 1) -> None:
     group_id_str = str(group_id)
     count = get_group_count(plugin, group_id_str)
     if count > 0:
-        plugin.group_counts[group_id_str] = count - 1
-        await save_group_counts(plugin)
+        plugin.group_counts[group_id_str] = max(0, count - amount)
+        await persist_group_counts(plugin, group_id_str)
+
+
+class QuotaLedger:
+    def __init__(self, plugin, shards: int = 64):
+        self.plugin = plugin
+        self.locks = [asyncio.Lock() for _ in range(shards)]
+        self.reserved = 0
+        self.committed = 0
+        self.refunded = 0
+
+    def _locks(self, user_id: str, group_id: str | None) -> List[asyncio.Lock]:
+        indexes = {hash(f"user:{user_id}") % len(self.locks)}
+        if group_id:
+            indexes.add(hash(f"group:{group_id}") % len(self.locks))
+        return [self.locks[i] for i in sorted(indexes)]
+
+    async def _locked(self, user_id: str, group_id: str | None, func, *args):
+        locks = self._locks(user_id, group_id)
+        for lock in locks:
+            await lock.acquire()
+        try:
+            return await func(*args)
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+
+    async def reserve(self, user_id: str, group_id: str | None, amount: int = 1) -> Dict[str, Any] | None:
+        return await self._locked(user_id, group_id, self._reserve, str(user_id), group_id, amount)
+
+    async def _reserve(self, user_id: str, group_id: str | None, amount: int) -> Dict[str, Any] | None:
+        plugin = self.plugin
+        user_count = get_user_count(plugin, user_id)
+        group_count = get_group_count(plugin, group_id) if group_id else 0
+        user_limit_on = plugin.conf.get("enable_user_limit", True)
+        group_limit_on = bool(plugin.conf.get("enable_group_limit", False) and group_id)
+        has_group_count = not group_limit_on or group_count >= amount
+        has_user_count = not user_limit_on or user_count >= amount
+        if (group_id and not has_group_count and not has_user_count) or (not group_id and not has_user_count):
+            return None
+        reservation = {
+            "user_id": user_id,
+            "group_id": group_id,
+            "amount": amount,
+            "user": min(amount, user_count) if user_limit_on else 0,
+            "group": min(amount, group_count) if group_limit_on else 0,
+        }
+        await self._apply(reservation, -reservation["user"], -reservation["group"])
+        self.reserved += amount
+        return reservation
+
+    async def _apply(self, reservation: Dict[str, Any], user_delta: int, group_delta: int) -> None:
+        plugin = self.plugin
+        user_id, group_id = reservation["user_id"], reservation["group_id"]
+        if user_delta:
+            plugin.user_counts[user_id] = max(0, get_user_count(plugin, user_id) + user_delta)
+            await persist_user_counts(plugin, user_id)
+        if group_delta and group_id:
+            plugin.group_counts[str(group_id)] = max(0, get_group_count(plugin, group_id) + group_delta)
+            await persist_group_counts(plugin, str(group_id))
+
+    async def settle(self, reservation: Dict[str, Any] | None, used: int) -> None:
+        if not reservation or reservation.get("settled"):
+            return
+        reservation["settled"] = True
+        await self._locked(reservation["user_id"], reservation["group_id"], self._settle, reservation, used)
+
+    async def _settle(self, reservation: Dict[str, Any], used: int) -> None:
+        plugin = self.plugin
+        amount = reservation["amount"]
+        extra = max(0, used - amount)
+        unused = max(0, amount - used)
+        user_delta = group_delta = 0
+        if extra:
+            if plugin.conf.get("enable_user_limit", True):
+                user_delta -= extra
+            if reservation["group_id"] and plugin.conf.get("enable_group_limit", False):
+                group_delta -= extra
+        if unused:
+            user_delta += min(unused, reservation["user"])
+            group_delta += min(unused, reservation["group"])
+        await self._apply(reservation, user_delta, group_delta)
+        self.committed += min(used, amount) + extra
+        self.refunded += unused
+
+    async def release_unclaimed(self, reservation: Dict[str, Any] | None) -> None:
+        if reservation and not reservation.get("job"):
+            await self.settle(reservation, 0)
+
+
+class CheckinBook:
+    def __init__(self):
+        self.day = ""
+        self.today: Dict[str, int] = {}
+        self.yesterday: Dict[str, int] = {}
+
+    @staticmethod
+    def previous_day(day: str) -> str:
+        return (date.fromisoformat(day) - timedelta(days=1)).isoformat()
+
+    def rotate(self, day: str) -> bool:
+        if day == self.day:
+            return False
+        self.yesterday = self.today if self.day == self.previous_day(day) else {}
+        self.today = {}
+        self.day = day
+        return True
+
+    def checked_in(self, user_id: str) -> bool:
+        return user_id in self.today
+
+    def check_in(self, user_id: str) -> int:
+        streak = self.yesterday.get(user_id, 0) + 1
+        self.today[user_id] = streak
+        return streak
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"day": self.day, "today": dict(self.today), "yesterday": dict(self.yesterday)}
+
+    def load_dict(self, data: Dict[str, Any], day: str) -> None:
+        if "day" in data and isinstance(data.get("today"), dict):
+            self.day = str(data["day"])
+            self.today = {str(k): int(v) for k, v in data["today"].items()}
+            self.yesterday = {str(k): int(v) for k, v in (data.get("yesterday") or {}).items()}
+        else:
+            previous = self.previous_day(day)
+            self.day = day
+            self.today = {str(k): 1 for k, v in data.items() if v == day}
+            self.yesterday = {str(k): 1 for k, v in data.items() if v == previous}
+        self.rotate(day)
+
+
+def _today() -> str:
+    return datetime.now().strftime("%Y-%m-%d")
 
 
 async def load_user_checkin_data(plugin) -> None:
+    today_str = _today()
+    book = CheckinBook()
+    plugin.checkins = book
+    if plugin.quota_store:
+        book.day = today_str
+        book.today = await plugin.quota_store.load_checkins(today_str)
+        book.yesterday = await plugin.quota_store.load_checkins(book.previous_day(today_str))
+        migrated = await _migrate_json(plugin.user_checkin_file, "签到记录")
+        if migrated is not None:
+            book.load_dict(migrated, today_str)
+            await plugin.quota_store.set_checkins(book.day, book.today)
+            await plugin.quota_store.set_checkins(book.previous_day(book.day), book.yesterday)
+            await _finish_migration(plugin.user_checkin_file, "签到记录", len(book.today) + len(book.yesterday))
+        await plugin.quota_store.prune_checkins(book.previous_day(today_str))
+        return
     if not plugin.user_checkin_file.exists():
-        plugin.user_checkin_data = {}
+        book.rotate(today_str)
         return
     loop = asyncio.get_running_loop()
     try:
         content = await loop.run_in_executor(None, plugin.user_checkin_file.read_text, "utf-8")
         data = await loop.run_in_executor(None, json.loads, content)
         if isinstance(data, dict):
-            plugin.user_checkin_data = {str(k): v for k, v in data.items()}
+            book.load_dict(data, today_str)
     except Exception as e:
         logger.error(f"加载用户签到文件时发生错误: {e}", exc_info=True)
-        plugin.user_checkin_data = {}
+    book.rotate(today_str)
 
 
 async def save_user_checkin_data(plugin) -> None:
@@ -111,9 +385,9 @@ async def save_user_checkin_data(plugin) -> None:
     try:
         json_data = await loop.run_in_executor(
             None,
-            functools.partial(json.dumps, plugin.user_checkin_data, ensure_ascii=False, indent=4),
+            functools.partial(json.dumps, plugin.checkins.to_dict(), ensure_ascii=False),
         )
-        await loop.run_in_executor(None, plugin.user_checkin_file.write_text, json_data, "utf-8")
+        await loop.run_in_executor(None, write_json_atomic, plugin.user_checkin_file, json_data)
     except Exception as e:
         logger.error(f"保存用户签到文件时发生错误: {e}", exc_info=True)
 
@@ -123,8 +397,13 @@ async def handle_checkin(plugin, event: AstrMessageEvent):
         yield event.plain_result("📅 本机器人未开启签到功能。")
         return
     user_id = event.get_sender_id()
-    today_str = datetime.now().strftime("%Y-%m-%d")
-    if plugin.user_checkin_data.get(user_id) == today_str:
+    today_str = _today()
+    if plugin.checkins.rotate(today_str):
+        if plugin.quota_store:
+            await plugin.quota_store.prune_checkins(plugin.checkins.previous_day(today_str))
+        else:
+            await persist_user_checkins(plugin)
+    if plugin.checkins.checked_in(user_id):
         yield event.plain_result(f"您今天已经签到过了。\n剩余次数: {plugin._get_user_count(user_id)}")
         return
     if str(plugin.conf.get("enable_random_checkin", False)).lower() == "true":
@@ -135,10 +414,13 @@ async def handle_checkin(plugin, event: AstrMessageEvent):
     current_count = plugin._get_user_count(user_id)
     new_count = current_count + reward
     plugin.user_counts[user_id] = new_count
-    await save_user_counts(plugin)
-    plugin.user_checkin_data[user_id] = today_str
-    await save_user_checkin_data(plugin)
-    yield event.plain_result(f"🎉 签到成功！获得 {reward} 次，当前剩余: {new_count} 次。")
+    await persist_user_counts(plugin, user_id)
+    streak = plugin.checkins.check_in(user_id)
+    await persist_user_checkins(plugin, user_id)
+    reply = f"🎉 签到成功！获得 {reward} 次，当前剩余: {new_count} 次。"
+    if streak > 1:
+        reply += f"\n已连续签到 {streak} 天。"
+    yield event.plain_result(reply)
 
 
 async def add_user_counts(plugin, event: AstrMessageEvent):
@@ -161,7 +443,7 @@ async def add_user_counts(plugin, event: AstrMessageEvent):
         return
     current_count = plugin._get_user_count(target_qq)
     plugin.user_counts[str(target_qq)] = current_count + count
-    await save_user_counts(plugin)
+    await persist_user_counts(plugin, str(target_qq))
     yield event.plain_result(f"✅ 已为用户 {target_qq} 增加 {count} 次，TA当前剩余 {current_count + count} 次。")
 
 
@@ -175,10 +457,126 @@ async def add_group_counts(plugin, event: AstrMessageEvent):
     target_group, count = match.group(1), int(match.group(2))
     current_count = plugin._get_group_count(target_group)
     plugin.group_counts[str(target_group)] = current_count + count
-    await save_group_counts(plugin)
+    await persist_group_counts(plugin, str(target_group))
     yield event.plain_result(f"✅ 已为群组 {target_group} 增加 {count} 次，该群当前剩余 {current_count + count} 次。")
 
 
+BULK_COUNT_MAX = 9999
+QQ_ID_PATTERN = re.compile(r"^[1-9]\d{4,11}$")
+
+
+def _valid_bulk_count(count: int, mode: str) -> bool:
+    return (1 if mode == "add" else 0) <= count <= BULK_COUNT_MAX
+
+
+def _parse_bulk_file(content: str, default_count: int | None, mode: str) -> Tuple[Dict[str, int], int]:
+    entries: Dict[str, int] = {}
+    skipped = 0
+    try:
+        data = json.loads(content)
+    except json.JSONDecodeError:
+        data = None
+    if isinstance(data, dict):
+        rows = list(data.items())
+    elif isinstance(data, list):
+        rows = [
+            (item.get("qq") or item.get("user_id"), item.get("count")) if isinstance(item, dict) else (item, None)
+            for item in data
+        ]
+    else:
+        rows = [(row[0], row[1] if len(row) > 1 else None) for row in csv.reader(io.StringIO(content)) if row]
+        if rows and not str(rows[0][0]).strip().isdigit():
+            rows = rows[1:]
+    for user_id, count in rows:
+        user_id = str(user_id or "").strip()
+        count_text = str(count).strip() if count is not None else ""
+        if count_text.lstrip("-").isdigit():
+            count = int(count_text)
+        elif not count_text:
+            count = default_count
+        else:
+            count = None
+        if not QQ_ID_PATTERN.match(user_id) or count is None or not _valid_bulk_count(count, mode):
+            skipped += 1
+            continue
+        entries[user_id] = count
+    return entries, skipped
+
+
+async def _group_member_ids(event: AstrMessageEvent, group_id: str) -> List[str]:
+    api = getattr(getattr(event, "bot", None), "api", None)
+    if api is None:
+        raise ValueError("当前平台不支持获取群成员列表")
+    members = await api.call_action("get_group_member_list", group_id=int(group_id))
+    self_id = str(event.get_self_id())
+    return [str(m["user_id"]) for m in members or [] if "user_id" in m and str(m["user_id"]) != self_id]
+
+
+async def _read_bulk_file(file_seg: File) -> str:
+    path = await file_seg.get_file()
+    loop = asyncio.get_running_loop()
+    raw = await loop.run_in_executor(None, Path(path).read_bytes)
+    return raw.decode("utf-8-sig")
+
+
+async def bulk_user_counts(plugin, event: AstrMessageEvent, mode: str):
+    if not plugin.is_global_admin(event):
+        return
+    verb = "增加" if mode == "add" else "设置"
+    usage = (
+        f"格式错误:\n#手办化批量{verb}次数 <QQ号...|@用户...|本群|群<群号>> <次数>\n"
+        f"或附带 CSV/JSON 文件 (每行 QQ号,次数)"
+    )
+    tokens = event.message_str.strip().split()[1:]
+    count = int(tokens.pop()) if tokens and tokens[-1].lstrip("-").isdigit() else None
+    if count is not None and not _valid_bulk_count(count, mode):
+        yield event.plain_result(f"❌ 次数必须在 {1 if mode == 'add' else 0}~{BULK_COUNT_MAX} 之间。\n{usage}")
+        return
+    targets: List[str] = [
+        str(seg.qq) for seg in event.message_obj.message if isinstance(seg, At) and QQ_ID_PATTERN.match(str(seg.qq))
+    ]
+    entries: Dict[str, int] = {}
+    skipped = 0
+    try:
+        for token in tokens:
+            if token == "本群" and event.get_group_id():
+                targets.extend(await _group_member_ids(event, event.get_group_id()))
+            elif token.startswith("群") and token[1:].isdigit():
+                targets.extend(await _group_member_ids(event, token[1:]))
+            elif QQ_ID_PATTERN.match(token):
+                targets.append(token)
+            else:
+                skipped += 1
+        file_seg = next((seg for seg in event.message_obj.message if isinstance(seg, File)), None)
+        if file_seg:
+            file_entries, file_skipped = _parse_bulk_file(await _read_bulk_file(file_seg), count, mode)
+            entries.update(file_entries)
+            skipped += file_skipped
+    except Exception as e:
+        logger.error(f"批量{verb}次数时获取目标失败: {e}", exc_info=True)
+        yield event.plain_result(f"❌ 获取目标失败: {e}")
+        return
+    if targets and count is None:
+        yield event.plain_result(usage)
+        return
+    for user_id in targets:
+        entries.setdefault(user_id, count)
+    if not entries:
+        yield event.plain_result(f"{usage}\n(跳过 {skipped} 条无效条目)" if skipped else usage)
+        return
+
+    for user_id, amount in entries.items():
+        current = get_user_count(plugin, user_id)
+        plugin.user_counts[user_id] = current + amount if mode == "add" else amount
+    await persist_user_counts(plugin, *entries)
+    amounts = set(entries.values())
+    detail = f"每人{verb} {amounts.pop()} 次" if len(amounts) == 1 else f"按列表分别{verb}"
+    lines = [f"✅ 批量{verb}完成: 共 {len(entries)} 个用户，{detail}。"]
+    if skipped:
+        lines.append(f"⚠️ 跳过 {skipped} 条无效条目 (QQ号或次数不合法)。")
+    yield event.plain_result("\n".join(lines))
+
+
 async def query_counts(plugin, event: AstrMessageEvent):
     user_id_to_query = event.get_sender_id()
     if plugin.is_global_admin(event):
@@ -195,4 +593,15 @@ async def query_counts(plugin, event: AstrMessageEvent):
         reply_msg = f"您好，您当前个人剩余次数为: {user_count}"
     if group_id := event.get_group_id():
         reply_msg += f"\n本群共享剩余次数为: {plugin._get_group_count(group_id)}"
+    if plugin.is_global_admin(event):
+        reply_msg += "\n" + "\n".join(quota_stats(plugin))
     yield event.plain_result(reply_msg)
+
+
+def quota_stats(plugin) -> List[str]:
+    ledger = plugin.ledger
+    lines = [f"📊 次数预留: 预留 {ledger.reserved}, 扣除 {ledger.committed}, 退还 {ledger.refunded}"]
+    if plugin.quota_store:
+        lines.append(f"次数存储: SQLite, 已写入 {plugin.quota_store.writes} 次事务")
+    lines.extend(f"次数快照 {writer.describe()}" for writer in plugin.snapshots.values())
+    return lines
@@ -0,0 +1,104 @@
+import asyncio
+import hashlib
+import json
+import time
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Deque, Dict, List, Mapping, Set, Tuple
+
+from .actions_config import conf_int
+
+
+class LatencyWindow:
+    def __init__(self, size: int = 200, min_samples: int = 20):
+        self.samples: Deque[float] = deque(maxlen=size)
+        self.min_samples = min_samples
+
+    def add(self, latency: float) -> None:
+        self.samples.append(latency)
+
+    def percentile(self, q: float) -> float | None:
+        if len(self.samples) < self.min_samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def request_fingerprint(
+    api_type: str, model: str, prompt: str, settings: Mapping[str, Any], image_digests: List[str]
+) -> str:
+    material = json.dumps(
+        {
+            "api_type": api_type,
+            "model": model,
+            "prompt": prompt,
+            "settings": settings,
+            "images": image_digests,
+        },
+        ensure_ascii=False,
+        sort_keys=True,
+    )
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class GenerationCache:
+    def __init__(self, conf: Mapping[str, Any]):
+        self.conf = conf
+        self.results: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self.inflight: Dict[str, asyncio.Task] = {}
+        self.tasks: Set[asyncio.Task] = set()
+        self.cache_hits = 0
+        self.coalesced = 0
+        self.latency = LatencyWindow()
+        self.stream_first_url = LatencyWindow(min_samples=1)
+        self.retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def _cached(self, fingerprint: str) -> str | None:
+        entry = self.results.get(fingerprint)
+        if entry is None:
+            return None
+        stored_at, result = entry
+        if time.monotonic() - stored_at > conf_int(self.conf, "result_cache_ttl", 600, minimum=0):
+            del self.results[fingerprint]
+            return None
+        self.results.move_to_end(fingerprint)
+        return result
+
+    def join(self, fingerprint: str) -> Awaitable[str] | None:
+        if (cached := self._cached(fingerprint)) is not None:
+            self.cache_hits += 1
+            future = asyncio.get_running_loop().create_future()
+            future.set_result(cached)
+            return future
+        if task := self.inflight.get(fingerprint):
+            self.coalesced += 1
+            return asyncio.shield(task)
+        return None
+
+    async def run(self, fingerprint: str, call: Awaitable[str]) -> str:
+        task = asyncio.ensure_future(call)
+        self.inflight[fingerprint] = task
+        self.tasks.add(task)
+        task.add_done_callback(lambda t: self._finish(fingerprint, t))
+        return await asyncio.shield(task)
+
+    def _finish(self, fingerprint: str, task: asyncio.Task) -> None:
+        self.tasks.discard(task)
+        if self.inflight.get(fingerprint) is task:
+            del self.inflight[fingerprint]
+        if task.cancelled() or task.exception() is not None:
+            return
+        result = task.result()
+        if not result.startswith("http"):
+            return
+        self.results[fingerprint] = (time.monotonic(), result)
+        self.results.move_to_end(fingerprint)
+        while len(self.results) > conf_int(self.conf, "result_cache_size", 256, minimum=0):
+            self.results.popitem(last=False)
+
+    async def shutdown(self) -> None:
+        tasks = list(self.tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -50,6 +50,7 @@ async def prompt_help(plugin, event: AstrMessageEvent):
         "📘 手办化插件指令速览",
         "--------------------------------",
         "图生图: 发送图片 + 预设指令，或 @用户 + 预设指令",
+        "批量生成: 一条消息写多个预设，如 /手办化 #Q版化 #cos化",
         "文生图: /文生图 <描述>",
         "自定义提示词: /lm添加 <名称:提示词>",
         "查看提示词列表: /lm列表 (管理员)",
@@ -58,8 +59,13 @@ async def prompt_help(plugin, event: AstrMessageEvent):
         "查看预设效果: /lm效果 [预设名称]",
         "签到领取次数: /手办化签到",
         "查询次数: /手办化查询次数",
+        "查看生成任务: /手办化任务 [任务ID]",
         "增加次数: /手办化增加用户次数  /手办化增加群组次数 (管理员)",
+        "批量次数: /手办化批量增加次数  /手办化批量设置次数 <QQ号...|本群|群号> <次数> 或附带 CSV/JSON 文件 (管理员)",
         "管理 API Key: /手办化添加key  /手办化key列表  /手办化删除key (管理员)",
+        "图片缓存统计: /手办化缓存统计 (管理员)",
+        "后端熔断状态: /手办化后端状态 (管理员)",
+        "强制重新生成: 指令末尾加 --force，跳过结果缓存 (管理员)",
     ]
     yield event.plain_result("\n".join(msg_lines))
 
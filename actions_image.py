@@ -1,41 +1,171 @@
 import asyncio
 import base64
-import io
+import contextlib
+import functools
+import hashlib
 import json
+import random
 import re
-from datetime import datetime
+import time
+from collections import deque
 from pathlib import Path
-from typing import Any, Dict, List
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Mapping, NamedTuple, Tuple
 
 import aiohttp
-from PIL import Image as PILImage
 
 from astrbot import logger
-from astrbot.core.message.components import At, Image, Plain, Reply
+from astrbot.core.message.components import At, Image, Node, Nodes, Plain, Reply
 from astrbot.core.platform.astr_message_event import AstrMessageEvent
 
 from . import actions_count, actions_key, actions_prompt
+from .actions_admission import AdmissionRejected, AdmissionTicket
+from .actions_cache import AvatarCache, ImageCache, ResultStore
+from .actions_codec import (
+    CodecPool,
+    data_uri,
+    extract_first_frame,
+    extract_first_frame_full,
+    normalize_image,
+    normalize_profile,
+    output_profile,
+    probe_animation,
+    profile_key,
+    sniff_mime,
+)
+from .actions_config import conf_float, conf_int
+from .actions_generate import request_fingerprint
+
+
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+DOWNLOADABLE_BINARY_TYPES = {"application/octet-stream", "binary/octet-stream"}
+
+
+RETRYABLE_STATUSES = {401, 402, 403, 408, 409, 425, 429, 500, 502, 503, 504}
+KEY_ERROR_STATUSES = actions_key.AUTH_ERROR_STATUSES | actions_key.BALANCE_ERROR_STATUSES
+RETRY_BACKOFF_CAP = 10.0
+FORCE_FLAG_PATTERN = re.compile(r"(?:^|\s)--(?:force|重新生成)(?=\s|$)")
+
+
+class ImageFetchError(Exception):
+    pass
+
+
+class ApiAttempt(NamedTuple):
+    text: str
+    ok: bool
+    retryable: bool = False
+    backend_error: bool = False
+    sent: bool = True
+
+
+def _format_mb(size: int) -> str:
+    return f"{size / 1024 / 1024:.1f}MB"
+
+
+def _sha256_hex(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
 
 
 class ImageWorkflow:
-    def __init__(self, proxy_url: str | None = None):
+    def __init__(
+        self,
+        proxy_url: str | None = None,
+        conf: Dict[str, Any] | None = None,
+        data_dir: Path | None = None,
+    ):
         if proxy_url:
             logger.info(f"ImageWorkflow 使用代理: {proxy_url}")
-        self.session = aiohttp.ClientSession()
+        self.conf = conf or {}
+        self.fetch_session = self._create_session("fetch", 32, 8)
+        self.gen_session = self._create_session("generation", 32, 16)
         self.proxy = proxy_url
+        self.fetch_concurrency = conf_int(self.conf, "image_fetch_concurrency", 4, minimum=1)
+        self.max_download_bytes = conf_int(self.conf, "max_download_mb", 20, minimum=1) * 1024 * 1024
+        self.fetch_timeout = aiohttp.ClientTimeout(
+            total=conf_float(self.conf, "image_fetch_timeout", 30.0, minimum=1.0),
+            sock_connect=conf_float(self.conf, "api_connect_timeout", 10.0, minimum=1.0),
+        )
+        self.avatar_cache = AvatarCache(
+            data_dir / "avatar_cache" if data_dir else None,
+            conf_int(self.conf, "avatar_cache_memory_mb", 32, minimum=0) * 1024 * 1024,
+            conf_int(self.conf, "avatar_cache_ttl", 21600, minimum=0),
+            conf_int(self.conf, "avatar_cache_disk_mb", 64, minimum=0) * 1024 * 1024,
+        )
+        self.image_cache = ImageCache(
+            data_dir / "image_cache" if data_dir and self.conf.get("image_cache_disk", False) else None,
+            conf_int(self.conf, "image_cache_memory_mb", 128, minimum=0) * 1024 * 1024,
+            conf_int(self.conf, "image_cache_disk_mb", 512, minimum=0) * 1024 * 1024,
+        )
+        self.codec = CodecPool(conf_int(self.conf, "codec_workers", 2, minimum=0))
+        self.result_store = (
+            ResultStore(
+                data_dir / "results",
+                conf_int(self.conf, "result_store_mb", 512, minimum=1) * 1024 * 1024,
+                conf_float(self.conf, "result_store_days", 7.0, minimum=0.0) * 86400,
+            )
+            if data_dir and self.conf.get("result_store_enabled", True)
+            else None
+        )
+
+    def _create_session(self, pool: str, default_limit: int, default_per_host: int) -> aiohttp.ClientSession:
+        connector = aiohttp.TCPConnector(
+            limit=conf_int(self.conf, f"{pool}_pool_limit", default_limit, minimum=0),
+            limit_per_host=conf_int(self.conf, f"{pool}_pool_limit_per_host", default_per_host, minimum=0),
+            keepalive_timeout=conf_int(self.conf, "pool_keepalive_timeout", 30, minimum=1),
+            ttl_dns_cache=conf_int(self.conf, "pool_dns_cache_ttl", 300, minimum=0) or None,
+            use_dns_cache=conf_int(self.conf, "pool_dns_cache_ttl", 300, minimum=0) > 0,
+        )
+        return aiohttp.ClientSession(connector=connector)
+
+    async def encode_data_uris(self, img_bytes_list: List[bytes]) -> List[str]:
+        return list(await asyncio.gather(*(self.codec.run(data_uri, img) for img in img_bytes_list)))
 
-    async def _download_image(self, url: str) -> bytes | None:
+    async def _read_capped(self, resp: aiohttp.ClientResponse) -> bytearray:
+        cap = self.max_download_bytes
+        mime = resp.headers.get("Content-Type", "").split(";")[0].strip().lower()
+        if mime and not mime.startswith("image/") and mime not in DOWNLOADABLE_BINARY_TYPES:
+            raise ImageFetchError(f"链接内容不是图片 ({mime})")
+        declared = resp.content_length
+        if declared is not None and declared > cap:
+            raise ImageFetchError(f"图片过大 ({_format_mb(declared)}，上限 {_format_mb(cap)})")
+
+        buf = bytearray(declared or 0)
+        received = 0
+        with memoryview(buf) if declared else contextlib.nullcontext() as view:
+            async for chunk in resp.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                end = received + len(chunk)
+                if end > cap:
+                    raise ImageFetchError(f"图片过大 (超过 {_format_mb(cap)})")
+                if view is None:
+                    buf += chunk
+                elif end > declared:
+                    raise ImageFetchError("图片实际大小与声明不符")
+                else:
+                    view[received:end] = chunk
+                received = end
+        if declared and received < declared:
+            raise ImageFetchError("图片下载不完整")
+        return buf
+
+    async def _fetch_image(
+        self, url: str, headers: Dict[str, str] | None = None
+    ) -> Tuple[bytearray | None, Mapping[str, str]]:
         logger.info(f"正在尝试下载图片: {url}")
         try:
-            async with self.session.get(url, proxy=self.proxy, timeout=30) as resp:
-                resp.raise_for_status()
-                return await resp.read()
-        except aiohttp.ClientResponseError as e:
-            logger.error(f"图片下载失败: HTTP状态码 {e.status}, URL: {url}, 原因: {e.message}")
-            return None
+            async with self.fetch_session.get(
+                url, headers=headers, proxy=self.proxy, timeout=self.fetch_timeout
+            ) as resp:
+                if resp.status == 304 and headers:
+                    return None, resp.headers
+                if resp.status != 200:
+                    raise ImageFetchError(f"图片下载失败 (HTTP {resp.status})")
+                return await self._read_capped(resp), resp.headers
+        except ImageFetchError as e:
+            logger.error(f"图片下载中止: {e}, URL: {url}")
+            raise
         except asyncio.TimeoutError:
-            logger.error(f"图片下载失败: 请求超时 (30s), URL: {url}")
-            return None
+            logger.error(f"图片下载失败: 请求超时 ({self.fetch_timeout.total:.0f}s), URL: {url}")
+            raise ImageFetchError("图片下载超时") from None
         except Exception as e:
             logger.error(
                 "图片下载失败: 发生未知错误, URL: %s, 错误类型: %s, 错误: %s",
@@ -44,34 +174,61 @@ class ImageWorkflow:
                 e,
                 exc_info=True,
             )
-            return None
+            raise ImageFetchError(f"图片下载失败 ({type(e).__name__})") from e
+
+    async def _download_image(self, url: str) -> bytearray:
+        body, _ = await self._fetch_image(url)
+        return body
 
     async def _get_avatar(self, user_id: str) -> bytes | None:
         if not user_id.isdigit():
             logger.warning(f"无法获取非 QQ 平台或无效 QQ 号 {user_id} 的头像。")
             return None
+        cached, fresh, meta = await self.avatar_cache.lookup(user_id)
+        if cached and fresh:
+            return cached
+
+        headers: Dict[str, str] = {}
+        if cached:
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
         avatar_url = f"https://q1.qlogo.cn/g?b=qq&nk={user_id}&s=640"
-        return await self._download_image(avatar_url)
+        try:
+            raw, resp_headers = await self._fetch_image(avatar_url, headers)
+        except ImageFetchError as e:
+            if not cached:
+                raise ImageFetchError(f"头像获取失败 ({user_id}): {e}") from e
+            logger.warning(f"头像重新验证失败, 使用过期缓存 ({user_id}): {e}")
+            return cached
+        if raw is None:
+            await self.avatar_cache.touch(user_id, cached, meta)
+            return cached
+
+        avatar = await self._first_frame(raw)
+        await self.avatar_cache.store(
+            user_id, avatar, resp_headers.get("ETag"), resp_headers.get("Last-Modified")
+        )
+        return avatar
 
     def _extract_first_frame_sync(self, raw: bytes) -> bytes:
-        img_io = io.BytesIO(raw)
-        try:
-            with PILImage.open(img_io) as img:
-                if getattr(img, "is_animated", False):
-                    logger.info("检测到动图, 将抽取第一帧进行生成")
-                    img.seek(0)
-                    first_frame = img.convert("RGBA")
-                    out_io = io.BytesIO()
-                    first_frame.save(out_io, format="PNG")
-                    return out_io.getvalue()
-        except Exception as e:
-            logger.warning(f"抽取图片帧时发生错误, 将返回原始数据: {e}", exc_info=True)
-        return raw
+        return extract_first_frame(raw)
+
+    async def _first_frame(self, raw: bytes) -> bytes:
+        if probe_animation(raw) is False:
+            return raw
+        return await self.codec.run(extract_first_frame_full, raw)
 
     async def _load_bytes(self, src: str) -> bytes | None:
+        if cached := await self.image_cache.get_source(src):
+            return cached
         raw: bytes | None = None
         loop = asyncio.get_running_loop()
         if Path(src).is_file():
+            size = Path(src).stat().st_size
+            if size > self.max_download_bytes:
+                raise ImageFetchError(f"图片过大 ({_format_mb(size)}，上限 {_format_mb(self.max_download_bytes)})")
             raw = await loop.run_in_executor(None, Path(src).read_bytes)
         elif src.startswith("http"):
             raw = await self._download_image(src)
@@ -79,66 +236,210 @@ class ImageWorkflow:
             raw = await loop.run_in_executor(None, base64.b64decode, src[9:])
         if not raw:
             return None
-        return await loop.run_in_executor(None, self._extract_first_frame_sync, raw)
+        digest = await loop.run_in_executor(None, _sha256_hex, raw)
+        if cached := await self.image_cache.get_content(digest):
+            self.image_cache.link(src, digest)
+            return cached
+        img = await self._first_frame(raw)
+        self.image_cache.put(src, digest, img)
+        return img
+
+    async def _load_first(self, candidates: List[str]) -> bytes | None:
+        for src in candidates:
+            if cached := await self.image_cache.get_source(src):
+                return cached
+        error: ImageFetchError | None = None
+        for idx, src in enumerate(candidates):
+            try:
+                img = await self._load_bytes(src)
+            except ImageFetchError as e:
+                error = e
+                continue
+            if img:
+                digest = self.image_cache.sources.get(src)
+                if digest:
+                    for alias in candidates[idx + 1 :]:
+                        self.image_cache.link(alias, digest)
+                return img
+        if error:
+            raise error
+        return None
 
-    async def get_images(self, event: AstrMessageEvent) -> List[bytes]:
+    async def _gather_ordered(
+        self,
+        jobs: List[Callable[[], Awaitable[bytes | None]]],
+        limit: int | None = None,
+        errors: List[str] | None = None,
+    ) -> List[bytes]:
         img_bytes_list: List[bytes] = []
-        at_user_ids: List[str] = []
+        pending: Deque[Tuple[int, asyncio.Task]] = deque()
+        job_iter = enumerate(jobs, start=1)
+
+        def window() -> int:
+            if limit is None:
+                return self.fetch_concurrency
+            return min(self.fetch_concurrency, limit - len(img_bytes_list))
+
+        try:
+            while True:
+                while len(pending) < window() and (item := next(job_iter, None)):
+                    idx, job = item
+                    pending.append((idx, asyncio.create_task(job())))
+                if not pending:
+                    break
+                idx, task = pending.popleft()
+                try:
+                    result = await task
+                except ImageFetchError as e:
+                    logger.warning(f"第 {idx} 个图片来源加载失败: {e}")
+                    if errors is not None:
+                        errors.append(str(e))
+                    continue
+                except Exception as e:
+                    logger.warning(f"第 {idx} 个图片来源加载失败: {e!r}")
+                    continue
+                if result:
+                    img_bytes_list.append(result)
+                    if limit is not None and len(img_bytes_list) >= limit:
+                        break
+        finally:
+            for _, task in pending:
+                task.cancel()
+        return img_bytes_list
 
+    async def _normalize_one(self, img: bytes, profile: Dict[str, Any]) -> bytes:
+        loop = asyncio.get_running_loop()
+        digest = await loop.run_in_executor(None, _sha256_hex, img)
+        variant = profile_key(profile)
+        if cached := await self.image_cache.get_derived(digest, variant):
+            return cached
+        normalized = await self.codec.run(
+            normalize_image, img, profile["max_edge"], profile["max_bytes"], profile["fmt"], profile["quality"]
+        )
+        if len(normalized) < len(img):
+            logger.info(f"图片已规范化: {len(img) / 1024:.0f}KB -> {len(normalized) / 1024:.0f}KB")
+        self.image_cache.put_derived(digest, variant, normalized)
+        return normalized
+
+    async def normalize_images(self, img_bytes_list: List[bytes], api_type: str) -> List[bytes]:
+        profile = normalize_profile(self.conf, api_type)
+        if not profile or not img_bytes_list:
+            return img_bytes_list
+        return list(await asyncio.gather(*(self._normalize_one(img, profile) for img in img_bytes_list)))
+
+    def _collect_image_sources(self, event: AstrMessageEvent) -> List[List[str]]:
+        sources: List[List[str]] = []
         for seg in event.message_obj.message:
             if isinstance(seg, Reply) and seg.chain:
                 for s_chain in seg.chain:
                     if isinstance(s_chain, Image):
-                        if s_chain.url and (img := await self._load_bytes(s_chain.url)):
-                            img_bytes_list.append(img)
-                        elif s_chain.file and (img := await self._load_bytes(s_chain.file)):
-                            img_bytes_list.append(img)
-
+                        sources.append([src for src in (s_chain.url, s_chain.file) if src])
         for seg in event.message_obj.message:
             if isinstance(seg, Image):
-                if seg.url and (img := await self._load_bytes(seg.url)):
-                    img_bytes_list.append(img)
-                elif seg.file and (img := await self._load_bytes(seg.file)):
-                    img_bytes_list.append(img)
-            elif isinstance(seg, At):
-                at_user_ids.append(str(seg.qq))
-
-        if img_bytes_list:
-            return img_bytes_list
+                sources.append([src for src in (seg.url, seg.file) if src])
+        return [candidates for candidates in sources if candidates]
 
+    def count_image_sources(self, event: AstrMessageEvent) -> int:
+        return len(self._collect_image_sources(event))
+
+    async def get_images(
+        self, event: AstrMessageEvent, limit: int | None = None, errors: List[str] | None = None
+    ) -> List[bytes]:
+        errors = errors if errors is not None else []
+        sources = self._collect_image_sources(event)
+        if sources:
+            img_bytes_list = await self._gather_ordered(
+                [functools.partial(self._load_first, candidates) for candidates in sources], limit, errors
+            )
+            if img_bytes_list or errors:
+                return img_bytes_list
+
+        at_user_ids = [str(seg.qq) for seg in event.message_obj.message if isinstance(seg, At)]
         if at_user_ids:
-            for user_id in at_user_ids:
-                if avatar := await self._get_avatar(user_id):
-                    img_bytes_list.append(avatar)
-            return img_bytes_list
+            return await self._gather_ordered(
+                [functools.partial(self._get_avatar, user_id) for user_id in at_user_ids], limit, errors
+            )
 
-        if avatar := await self._get_avatar(event.get_sender_id()):
-            img_bytes_list.append(avatar)
+        return await self._gather_ordered(
+            [functools.partial(self._get_avatar, event.get_sender_id())], limit, errors
+        )
 
-        return img_bytes_list
+    def local_result_path(self, url: str) -> Path | None:
+        for mapping in self.conf.get("result_path_mappings") or []:
+            prefix, sep, local_dir = mapping.partition("=>")
+            if sep and prefix.strip() and url.startswith(prefix.strip()):
+                return Path(local_dir.strip()).expanduser() / url.split("?")[0].rstrip("/").split("/")[-1]
+        return None
+
+    async def store_result(self, url: str, platform: str | None = None) -> str | None:
+        local_path = self.local_result_path(url)
+        if local_path:
+            return str(local_path)
+        if not self.result_store:
+            return None
+        profile = output_profile(self.conf, platform)
+        store_key = f"{url}#{profile_key(profile)}" if profile else url
+        stored = self.result_store.lookup(store_key)
+        if stored:
+            return str(stored)
+        try:
+            body, _ = await self._fetch_image(url)
+        except ImageFetchError as e:
+            logger.warning(f"结果图片转存失败，将直接发送 URL: {e}")
+            return None
+        data = bytes(body)
+        if profile:
+            original_size = len(data)
+            data = await self.codec.run(
+                normalize_image, data, profile["max_edge"], profile["max_bytes"], profile["fmt"], profile["quality"]
+            )
+            logger.info(f"结果图片已压缩 ({platform}): {_format_mb(original_size)} -> {_format_mb(len(data))}")
+        loop = asyncio.get_running_loop()
+        digest = await loop.run_in_executor(None, _sha256_hex, data)
+        extension = sniff_mime(data).split("/")[-1].replace("jpeg", "jpg")
+        try:
+            path = await self.result_store.save(store_key, f"{digest}.{extension}", data)
+        except OSError as e:
+            logger.warning(f"结果图片写入失败，将直接发送 URL: {e}")
+            return None
+        if path is None:
+            logger.info(f"结果图片 ({_format_mb(len(data))}) 超过存储上限，将直接发送 URL")
+            return None
+        return str(path)
 
     async def terminate(self):
-        if self.session and not self.session.closed:
-            await self.session.close()
+        for session in (self.fetch_session, self.gen_session):
+            if session and not session.closed:
+                await session.close()
+        self.codec.shutdown()
 
 
 async def initialize(plugin) -> None:
     use_proxy = plugin.conf.get("use_proxy", False)
     proxy_url = plugin.conf.get("proxy_url") if use_proxy else None
-    plugin.iwf = plugin.ImageWorkflow(proxy_url)
+    plugin.iwf = plugin.ImageWorkflow(proxy_url, plugin.conf, plugin.plugin_data_dir)
     await actions_prompt.load_prompt_map(plugin)
+    await actions_count.open_quota_store(plugin)
     await actions_count.load_user_counts(plugin)
     await actions_count.load_group_counts(plugin)
     await actions_count.load_user_checkin_data(plugin)
+    await plugin.jobs.resume()
     logger.info("FigurinePro 插件已加载 (lmarena 风格)")
-    if not plugin.conf.get("api_keys"):
+    if not any(backend_keys(plugin, api_type) for api_type in plugin.backends.chain()):
         logger.warning("FigurinePro: 未配置任何 API 密钥，插件可能无法工作")
 
 
+def image_budget(plugin) -> int:
+    api_type = plugin.conf.get("api_type", "openai")
+    if api_type != "openai" or "chat/completions" not in (plugin.conf.get("openai_api_url") or ""):
+        return 1
+    return conf_int(plugin.conf, "max_multi_images", 5, minimum=1)
+
+
 async def handle_figurine_request(plugin, event: AstrMessageEvent):
     if plugin.conf.get("prefix", True) and not event.is_at_or_wake_command:
         return
-    text = event.message_str.strip()
+    text, force = pop_force_flag(event.message_str.strip())
     if not text:
         return
     cmd = text.split()[0].strip()
@@ -154,6 +455,8 @@ async def handle_figurine_request(plugin, event: AstrMessageEvent):
         user_prompt = plugin.prompt_map.get(cmd)
     else:
         return
+    presets = [] if is_bnn else batch_presets(plugin, text)
+    needed = max(1, len(presets))
 
     sender_id = event.get_sender_id()
     group_id = event.get_group_id()
@@ -167,97 +470,94 @@ async def handle_figurine_request(plugin, event: AstrMessageEvent):
             return
         if group_id and plugin.conf.get("group_whitelist", []) and group_id not in plugin.conf.get("group_whitelist", []):
             return
-        user_count = plugin._get_user_count(sender_id)
-        group_count = plugin._get_group_count(group_id) if group_id else 0
-        user_limit_on = plugin.conf.get("enable_user_limit", True)
-        group_limit_on = plugin.conf.get("enable_group_limit", False) and group_id
-        has_group_count = not group_limit_on or group_count > 0
-        has_user_count = not user_limit_on or user_count > 0
-        if group_id:
-            if not has_group_count and not has_user_count:
+    reservation = None
+    if not is_master:
+        reservation = await plugin.ledger.reserve(sender_id, group_id, needed)
+        if reservation is None:
+            if needed > 1:
+                yield event.plain_result(f"❌ 剩余次数不足，批量生成 {needed} 个预设需要 {needed} 次。")
+            elif group_id:
                 yield event.plain_result("❌ 本群次数与您的个人次数均已用尽。")
-                return
-        elif not has_user_count:
-            yield event.plain_result("❌ 您的使用次数已用完。")
+            else:
+                yield event.plain_result("❌ 您的使用次数已用完。")
             return
+    try:
+        async for result in _figurine_pipeline(
+            plugin, event, cmd, user_prompt, is_bnn, presets, force, is_master, reservation
+        ):
+            yield result
+    finally:
+        await plugin.ledger.release_unclaimed(reservation)
+
 
+async def _figurine_pipeline(
+    plugin,
+    event: AstrMessageEvent,
+    cmd: str,
+    user_prompt: str,
+    is_bnn: bool,
+    presets: List[str],
+    force: bool,
+    is_master: bool,
+    reservation: Dict[str, Any] | None,
+):
+    sender_id = event.get_sender_id()
+    group_id = event.get_group_id()
+    max_images = image_budget(plugin)
     img_bytes_list: List[bytes] = []
+    fetch_errors: List[str] = []
+    source_count = 0
     if plugin.iwf:
-        img_bytes_list = await plugin.iwf.get_images(event)
+        source_count = plugin.iwf.count_image_sources(event)
+        img_bytes_list = await plugin.iwf.get_images(event, limit=max_images, errors=fetch_errors)
+    fetch_reasons = "；".join(dict.fromkeys(fetch_errors))
     if not plugin.iwf or not img_bytes_list:
         if not is_bnn:
-            yield event.plain_result("请发送或引用一张图片。")
+            if fetch_reasons:
+                yield event.plain_result(f"❌ 图片获取失败: {fetch_reasons}")
+            else:
+                yield event.plain_result("请发送或引用一张图片。")
             return
+    if fetch_reasons:
+        yield event.plain_result(f"⚠️ 部分图片获取失败，已跳过: {fetch_reasons}")
 
-    allow_multi_images = plugin.conf.get("api_type", "openai") == "openai"
-    max_multi_cfg = plugin.conf.get("max_multi_images", 5)
-    try:
-        max_multi_images = max(1, int(max_multi_cfg))
-    except (TypeError, ValueError):
-        max_multi_images = 5
-
-    images_to_process: List[bytes] = []
+    images_to_process: List[bytes] = img_bytes_list
+    if plugin.iwf:
+        images_to_process = await plugin.iwf.normalize_images(img_bytes_list, plugin.conf.get("api_type", "openai"))
     display_cmd = cmd
     if is_bnn:
-        max_images = max_multi_images if allow_multi_images else 1
-        original_count = len(img_bytes_list)
-        if original_count > max_images:
-            images_to_process = img_bytes_list[:max_images]
-            yield event.plain_result(f"🎨 检测到 {original_count} 张图片，已选取前 {max_images} 张…")
-        else:
-            images_to_process = img_bytes_list if allow_multi_images else img_bytes_list[:1]
+        if source_count > max_images:
+            yield event.plain_result(f"🎨 检测到 {source_count} 张图片，已选取前 {max_images} 张…")
         display_cmd = user_prompt[:10] + "..." if len(user_prompt) > 10 else user_prompt
-        yield event.plain_result(f"🎨 检测到 {len(images_to_process)} 张图片，正在生成 [{display_cmd}]...")
-    else:
-        if not img_bytes_list:
-            yield event.plain_result("请发送或引用一张图片。")
-            return
-        if allow_multi_images:
-            if len(img_bytes_list) > max_multi_images:
-                images_to_process = img_bytes_list[:max_multi_images]
-                yield event.plain_result(
-                    f"🎨 检测到 {len(img_bytes_list)} 张图片，已选取前 {max_multi_images} 张…"
-                )
-            else:
-                images_to_process = img_bytes_list
-        else:
-            images_to_process = [img_bytes_list[0]]
-        yield event.plain_result(f"🎨 收到请求，正在生成 [{cmd}]...")
-
-    start_time = datetime.now()
-    res_url = await call_api(plugin, images_to_process, user_prompt)
-    elapsed = (datetime.now() - start_time).total_seconds()
-
-    if res_url.startswith("http"):
-        if not is_master:
-            if plugin.conf.get("enable_user_limit", True):
-                await plugin._decrease_user_count(sender_id)
-            if group_id and plugin.conf.get("enable_group_limit", False):
-                await plugin._decrease_group_count(group_id)
-
-        caption_parts = [f"✅ 生成成功 ({elapsed:.2f}s)", f"预设: {display_cmd}"]
-        if is_master:
-            caption_parts.append("剩余次数: ∞")
-        else:
-            user_count = plugin._get_user_count(sender_id)
-            caption_parts.append(f"个人剩余: {user_count}")
-            if group_id and plugin.conf.get("enable_group_limit", False):
-                group_count = plugin._get_group_count(group_id)
-                caption_parts.append(f"群组剩余: {group_count}")
-
-        if "127.0.0.1" in res_url or "localhost" in res_url:
-            image_name = res_url.split("/")[-1]
-            local_path = Path("~/QQBot/antigravity2api-nodejs/public/images/" + image_name).expanduser()
-            yield event.chain_result([Image.fromFileSystem(str(local_path)), Plain(" | ".join(caption_parts))])
-        else:
-            yield event.chain_result([Image.fromURL(res_url), Plain(" | ".join(caption_parts))])
+        announce = f"🎨 检测到 {len(images_to_process)} 张图片，正在生成 [{display_cmd}]..."
     else:
-        yield event.plain_result(f"❌ 生成失败 ({elapsed:.2f}s)\n原因: {res_url}")
+        if max_images > 1 and source_count > max_images:
+            yield event.plain_result(f"🎨 检测到 {source_count} 张图片，已选取前 {max_images} 张…")
+        announce = f"🎨 收到请求，正在生成 [{cmd}]..."
+        if len(presets) > 1:
+            announce = f"🎨 收到请求，正在批量生成 [{'/'.join(presets)}]..."
+
+    spec = {
+        "kind": "figurine",
+        "prompt": user_prompt,
+        "preset": display_cmd,
+        "sender_id": sender_id,
+        "group_id": group_id,
+        "self_id": event.get_self_id(),
+        "platform": event.get_platform_name(),
+        "is_master": is_master,
+        "force": force and is_master,
+        "reservation": reservation,
+    }
+    if len(presets) > 1:
+        spec["batch"] = [{"preset": name, "prompt": plugin.prompt_map[name]} for name in presets]
+    async for result in _dispatch_generation(plugin, event, spec, images_to_process, announce):
+        yield result
     event.stop_event()
 
 
 async def handle_text_to_image_request(plugin, event: AstrMessageEvent):
-    prompt = event.message_str.strip()
+    prompt, force = pop_force_flag(event.message_str.strip())
     if not prompt:
         yield event.plain_result("请提供文生图的描述。用法: #文生图 <描述>")
         return
@@ -266,93 +566,324 @@ async def handle_text_to_image_request(plugin, event: AstrMessageEvent):
     group_id = event.get_group_id()
     is_master = plugin.is_global_admin(event)
 
+    reservation = None
     if not is_master:
         if sender_id in plugin.conf.get("user_blacklist", []):
             yield event.plain_result("❌ 您已被禁止使用此功能。")
+            return
         if group_id and group_id in plugin.conf.get("group_blacklist", []):
             yield event.plain_result("❌ 本群已被禁止使用此功能。")
+            return
         if plugin.conf.get("user_whitelist", []) and sender_id not in plugin.conf.get("user_whitelist", []):
             yield event.plain_result("❌ 您不在白名单中，无法使用此功能。")
+            return
         if group_id and plugin.conf.get("group_whitelist", []) and group_id not in plugin.conf.get("group_whitelist", []):
             yield event.plain_result("❌ 本群不在白名单中，无法使用此功能。")
-        user_count = plugin._get_user_count(sender_id)
-        group_count = plugin._get_group_count(group_id) if group_id else 0
-        user_limit_on = plugin.conf.get("enable_user_limit", True)
-        group_limit_on = plugin.conf.get("enable_group_limit", False) and group_id
-        has_group_count = not group_limit_on or group_count > 0
-        has_user_count = not user_limit_on or user_count > 0
-        if group_id:
-            if not has_user_count and not has_group_count:
+            return
+        reservation = await plugin.ledger.reserve(sender_id, group_id)
+        if reservation is None:
+            if group_id:
                 yield event.plain_result("❌ 您的个人次数和本群次数均已用尽。")
-        elif not has_user_count:
-            yield event.plain_result("❌ 您的个人次数已用尽。")
+            else:
+                yield event.plain_result("❌ 您的个人次数已用尽。")
+            return
 
     display_prompt = prompt[:20] + "..." if len(prompt) > 20 else prompt
-    yield event.plain_result(f"🎨 收到文生图请求，正在生成 [{display_prompt}]...")
-
-    start_time = datetime.now()
-    res_url = await call_api(plugin, [], prompt)
-    elapsed = (datetime.now() - start_time).total_seconds()
-
-    if res_url.startswith("http"):
-        if not is_master:
-            if plugin.conf.get("enable_user_limit", True):
-                await plugin._decrease_user_count(sender_id)
-            if group_id and plugin.conf.get("enable_group_limit", False):
-                await plugin._decrease_group_count(group_id)
-
-        caption_parts = [f"✅ 生成成功 ({elapsed:.2f}s)"]
-        if is_master:
-            caption_parts.append("剩余次数: ∞")
-        else:
-            user_count = plugin._get_user_count(sender_id)
-            caption_parts.append(f"个人剩余: {user_count}")
-            if group_id and plugin.conf.get("enable_group_limit", False):
-                group_count = plugin._get_group_count(group_id)
-                caption_parts.append(f"群组剩余: {group_count}")
-
-        if "127.0.0.1" in res_url or "localhost" in res_url:
-            image_name = res_url.split("/")[-1]
-            local_path = Path("~/QQBot/antigravity2api-nodejs/public/images/" + image_name).expanduser()
-            yield event.chain_result([Image.fromFileSystem(str(local_path)), Plain(" | ".join(caption_parts))])
+    spec = {
+        "kind": "text",
+        "prompt": prompt,
+        "preset": None,
+        "sender_id": sender_id,
+        "group_id": group_id,
+        "self_id": event.get_self_id(),
+        "platform": event.get_platform_name(),
+        "is_master": is_master,
+        "force": force and is_master,
+        "reservation": reservation,
+    }
+    try:
+        async for result in _dispatch_generation(
+            plugin, event, spec, [], f"🎨 收到文生图请求，正在生成 [{display_prompt}]..."
+        ):
+            yield result
+    finally:
+        await plugin.ledger.release_unclaimed(reservation)
+    event.stop_event()
+
+
+async def run_generation(
+    plugin,
+    spec: Dict[str, Any],
+    image_bytes_list: List[bytes],
+    fingerprint: str,
+    ticket: AdmissionTicket | None = None,
+    shared: Awaitable[str] | None = None,
+) -> Tuple[str, float]:
+    try:
+        if shared is None and not spec.get("force"):
+            shared = plugin.generation.join(fingerprint)
+        if shared is not None:
+            if ticket:
+                plugin.admission.release(ticket)
+                ticket = None
+            start_time = time.monotonic()
+            return await shared, time.monotonic() - start_time
+        if ticket:
+            await plugin.admission.wait(ticket)
+        start_time = time.monotonic()
+        res_url = await plugin.generation.run(fingerprint, call_api(plugin, image_bytes_list, spec["prompt"]))
+        return res_url, time.monotonic() - start_time
+    finally:
+        if ticket:
+            plugin.admission.release(ticket)
+
+
+async def run_batch(
+    plugin,
+    spec: Dict[str, Any],
+    image_bytes_list: List[bytes],
+    fingerprints: List[str],
+    tickets: List[AdmissionTicket],
+) -> Tuple[List[Tuple[str | None, str]], float]:
+    items = spec.get("batch") or [spec]
+    start_time = time.monotonic()
+    outcomes = await asyncio.gather(
+        *(
+            run_generation(plugin, dict(spec, **item), image_bytes_list, fingerprint, ticket)
+            for item, fingerprint, ticket in zip(items, fingerprints, tickets)
+        ),
+        return_exceptions=True,
+    )
+    results = []
+    for item, outcome in zip(items, outcomes):
+        if isinstance(outcome, asyncio.CancelledError):
+            raise outcome
+        if isinstance(outcome, BaseException):
+            logger.error(f"批量生成 [{item.get('preset')}] 失败: {outcome!r}")
+            results.append((item.get("preset"), f"发生未知错误: {outcome}"))
         else:
-            yield event.chain_result([Image.fromURL(res_url), Plain(" | ".join(caption_parts))])
+            results.append((item.get("preset"), outcome[0]))
+    return results, time.monotonic() - start_time
+
+
+def enter_tickets(plugin, spec: Dict[str, Any], overflow: bool = False) -> List[AdmissionTicket]:
+    tickets: List[AdmissionTicket] = []
+    try:
+        for index in range(len(spec.get("batch") or [spec])):
+            tickets.append(
+                plugin.admission.enter(
+                    spec["sender_id"], spec["group_id"], exempt=spec["is_master"] or index > 0, overflow=overflow
+                )
+            )
+    except AdmissionRejected:
+        for ticket in tickets:
+            plugin.admission.release(ticket)
+        raise
+    return tickets
+
+
+async def build_result_chain(
+    plugin, spec: Dict[str, Any], results: List[Tuple[str | None, str]], elapsed: float
+) -> List[Any]:
+    urls = [url for _, res in results for url in result_urls(res)]
+    failures = [(preset, res) for preset, res in results if not result_urls(res)]
+    await plugin.ledger.settle(spec.get("reservation"), len(urls))
+    if not urls:
+        if len(results) == 1:
+            return [Plain(f"❌ 生成失败 ({elapsed:.2f}s)\n原因: {results[0][1]}")]
+        reasons = "\n".join(f"[{preset}] {res}" for preset, res in failures)
+        return [Plain(f"❌ 生成失败 ({elapsed:.2f}s)\n{reasons}")]
+
+    delivery_started = time.monotonic()
+    platform = spec.get("platform")
+    stored = [asyncio.create_task(plugin.iwf.store_result(url, platform)) for url in urls] if plugin.iwf else []
+    sender_id, group_id = spec["sender_id"], spec["group_id"]
+
+    caption_parts = []
+    if spec.get("batch"):
+        caption_parts.append(f"预设: {'/'.join(item['preset'] for item in spec['batch'])}")
+    elif spec.get("preset"):
+        caption_parts.append(f"预设: {spec['preset']}")
+    if len(urls) > 1:
+        caption_parts.append(f"共 {len(urls)} 张")
+    if spec["is_master"]:
+        caption_parts.append("剩余次数: ∞")
     else:
-        yield event.plain_result(f"❌ 生成失败 ({elapsed:.2f}s)\n原因: {res_url}")
-    event.stop_event()
+        user_count = plugin._get_user_count(sender_id)
+        caption_parts.append(f"个人剩余: {user_count}")
+        if group_id and plugin.conf.get("enable_group_limit", False):
+            group_count = plugin._get_group_count(group_id)
+            caption_parts.append(f"群组剩余: {group_count}")
+    local_paths = await asyncio.gather(*stored) if stored else [None] * len(urls)
+    delivery = time.monotonic() - delivery_started
+    caption_parts.insert(0, f"✅ 生成成功 (生成 {elapsed:.2f}s / 投递 {delivery:.2f}s)")
+    caption = " | ".join(caption_parts)
+    if failures:
+        caption += "\n" + "\n".join(f"⚠️ [{preset}] 生成失败: {res}" for preset, res in failures)
+
+    images = [
+        Image.fromFileSystem(path) if path else Image.fromURL(url) for url, path in zip(urls, local_paths)
+    ]
+    if len(images) > 1 and plugin.conf.get("batch_reply_mode", "merged") == "forward":
+        uin = spec.get("self_id") or spec["sender_id"]
+        nodes = [Node(uin=uin, name="手办化", content=[image]) for image in images]
+        nodes.append(Node(uin=uin, name="手办化", content=[Plain(caption)]))
+        return [Nodes(nodes=nodes)]
+    return [*images, Plain(caption)]
+
+
+async def _dispatch_generation(
+    plugin, event: AstrMessageEvent, spec: Dict[str, Any], image_bytes_list: List[bytes], announce: str
+):
+    fingerprints = await generation_fingerprints(
+        plugin, image_bytes_list, [item["prompt"] for item in spec.get("batch") or [spec]]
+    )
+    try:
+        if plugin.jobs.enabled:
+            job, tickets = await plugin.jobs.submit(spec, image_bytes_list, fingerprints, event.unified_msg_origin)
+        else:
+            tickets = enter_tickets(plugin, spec)
+    except AdmissionRejected as e:
+        yield event.plain_result(f"❌ {e}")
+        return
+    queue_hint = plugin.admission.describe_wait(tickets[0])
+    if plugin.jobs.enabled:
+        yield event.plain_result(f"{announce}\n任务 {job['id']} 已加入队列{queue_hint}，完成后将自动发送结果。")
+        return
+
+    try:
+        yield event.plain_result(f"{announce}{queue_hint}")
+    except BaseException:
+        for ticket in tickets:
+            plugin.admission.release(ticket)
+        raise
+    results, elapsed = await run_batch(plugin, spec, image_bytes_list, fingerprints, tickets)
+    yield event.chain_result(await build_result_chain(plugin, spec, results, elapsed))
 
 
 def extract_image_url_from_response(plugin, data: Dict[str, Any]) -> str | None:
+    urls = extract_image_urls(plugin, data)
+    return urls[0] if urls else None
+
+
+def extract_image_urls(plugin, data: Dict[str, Any]) -> List[str]:
     try:
-        url = data["data"][0]["url"]
-        logger.info(f"成功从 API 响应中提取到 URL: {url[:50]}...")
-        return url
-    except (IndexError, TypeError, KeyError):
-        logger.warning(f"未能在响应中找到 'data[0].url'，原始响应 (截断): {str(data)[:200]}")
-        return None
+        urls = [item["url"] for item in data["data"] if isinstance(item, dict) and item.get("url")]
+    except (TypeError, KeyError):
+        urls = []
+    if urls:
+        logger.info(f"成功从 API 响应中提取到 {len(urls)} 个 URL: {urls[0][:50]}...")
+    else:
+        logger.warning(f"未能在响应中找到 'data[].url'，原始响应 (截断): {str(data)[:200]}")
+    return urls
 
 
-async def call_api(plugin, image_bytes_list: List[bytes], prompt: str) -> str:
-    api_type = plugin.conf.get("api_type", "openai")
+def result_urls(result: str) -> List[str]:
+    if not result.startswith("http"):
+        return []
+    return [line for line in result.split("\n") if line.startswith("http")]
+
 
+def batch_presets(plugin, text: str) -> List[str]:
+    presets: List[str] = []
+    for token in text.split():
+        name = token.lstrip("#/")
+        if name in plugin.prompt_map and name not in presets:
+            presets.append(name)
+    return presets[: conf_int(plugin.conf, "max_batch_presets", 4, minimum=1)]
+
+
+def resolve_endpoint(plugin, api_type: str | None = None) -> Tuple[str, str | None, str | None]:
+    api_type = api_type or plugin.conf.get("api_type", "openai")
     if api_type == "volcengine":
-        api_url = plugin.conf.get("volcengine_api_url") or plugin.conf.get("api_url")
-        model_name = plugin.conf.get("volcengine_model") or plugin.conf.get("model")
-    elif api_type == "openai":
-        api_url = plugin.conf.get("openai_api_url")
-        model_name = plugin.conf.get("openai_model")
-    else:
-        return f"未知的 API 类型: {api_type}"
+        return (
+            api_type,
+            plugin.conf.get("volcengine_api_url") or plugin.conf.get("api_url"),
+            plugin.conf.get("volcengine_model") or plugin.conf.get("model"),
+        )
+    if api_type == "openai":
+        return api_type, plugin.conf.get("openai_api_url"), plugin.conf.get("openai_model")
+    return api_type, None, None
 
-    if not api_url:
-        return f"API URL 未配置 ({api_type})"
-    if not model_name:
-        return f"模型名称未配置 ({api_type})"
 
-    api_key = await actions_key.get_api_key(plugin)
-    if not api_key:
-        return "无可用的 API Key"
-    headers = {"Content-Type": "application/json", "Authorization": f"Bearer {api_key}"}
+def backend_keys(plugin, api_type: str) -> List[str]:
+    return plugin.conf.get(f"{api_type}_api_keys") or plugin.conf.get("api_keys", [])
+
+
+def chain_capacity(plugin) -> int | None:
+    keys = [key for api_type in plugin.backends.chain() for key in backend_keys(plugin, api_type)]
+    return plugin.key_scheduler.capacity(list(dict.fromkeys(keys)))
+
+
+async def generation_fingerprints(plugin, image_bytes_list: List[bytes], prompts: List[str]) -> List[str]:
+    api_type, api_url, model_name = resolve_endpoint(plugin)
+    loop = asyncio.get_running_loop()
+    digests = [await loop.run_in_executor(None, _sha256_hex, img) for img in image_bytes_list]
+    settings = {
+        "api_url": api_url,
+        "image_size": plugin.conf.get("image_size"),
+        "sequential_image_generation": plugin.conf.get("sequential_image_generation"),
+        "watermark": plugin.conf.get("watermark"),
+    }
+    return [request_fingerprint(api_type, model_name or "", prompt, settings, digests) for prompt in prompts]
+
+
+def pop_force_flag(text: str) -> Tuple[str, bool]:
+    stripped, count = FORCE_FLAG_PATTERN.subn(" ", text)
+    return (stripped.strip(), True) if count else (text, False)
+
+
+async def call_api(plugin, image_bytes_list: List[bytes], prompt: str) -> str:
+    if not plugin.iwf:
+        return "ImageWorkflow 未初始化"
+    chain = plugin.backends.chain()
+    if not chain:
+        return f"未知的 API 类型: {plugin.conf.get('api_type', 'openai')}"
+
+    failure: str | None = None
+    for api_type in chain:
+        breaker = plugin.backends.breaker(api_type)
+        _, api_url, model_name = resolve_endpoint(plugin, api_type)
+        if not api_url or not model_name:
+            failure = failure or (f"API URL 未配置 ({api_type})" if not api_url else f"模型名称未配置 ({api_type})")
+            continue
+        if not breaker.allow(time.monotonic()):
+            logger.warning(f"后端 {api_type} 处于熔断状态，跳过")
+            failure = failure or f"后端 {api_type} 暂时不可用 (熔断中)"
+            continue
+        if api_type != chain[0]:
+            logger.warning(f"主后端不可用，切换到备用后端 {api_type}")
+
+        payload = await _build_payload(plugin, api_type, api_url, model_name, image_bytes_list, prompt)
+        if isinstance(payload, str):
+            breaker.cancel_probe()
+            return payload
+        started = time.monotonic()
+        try:
+            attempt = await _post_with_retries(plugin, api_type, api_url, payload)
+        except BaseException:
+            breaker.cancel_probe()
+            raise
+        now = time.monotonic()
+        failed = not attempt.ok and (attempt.retryable or attempt.backend_error)
+        breaker.record(not failed, now - started, now, attempt.text)
+        if not failed:
+            return attempt.text
+        failure = attempt.text
+    return failure or "所有后端均不可用，请稍后再试"
+
+
+async def _build_payload(
+    plugin, api_type: str, api_url: str, model_name: str, image_bytes_list: List[bytes], prompt: str
+) -> Dict[str, Any] | str:
+    image_uris: List[str] = []
+    if image_bytes_list:
+        multi_input = api_type == "openai" and "chat/completions" in api_url
+        try:
+            image_uris = await plugin.iwf.encode_data_uris(image_bytes_list if multi_input else image_bytes_list[:1])
+        except Exception as e:
+            logger.error(f"Base64 编码图片时出错: {e}", exc_info=True)
+            return f"图片编码失败: {e}"
 
     payload: Dict[str, Any] = {}
 
@@ -366,15 +897,10 @@ async def call_api(plugin, image_bytes_list: List[bytes], prompt: str) -> str:
             "response_format": "url",
             "watermark": plugin.conf.get("watermark", False),
         }
-        if image_bytes_list:
-            try:
-                img_b64 = base64.b64encode(image_bytes_list[0]).decode("utf-8")
-                payload["image"] = f"data:image/png;base64,{img_b64}"
-                if len(image_bytes_list) > 1:
-                    logger.warning(f"检测到 {len(image_bytes_list)} 张图片，火山引擎模型仅支持单张，已选取第一张")
-            except Exception as e:
-                logger.error(f"Base64 编码图片时出错: {e}", exc_info=True)
-                return f"图片编码失败: {e}"
+        if image_uris:
+            payload["image"] = image_uris[0]
+            if len(image_bytes_list) > 1:
+                logger.warning(f"检测到 {len(image_bytes_list)} 张图片，火山引擎模型仅支持单张，已选取第一张")
 
     elif api_type == "openai":
         is_chat_api = "chat/completions" in api_url
@@ -382,25 +908,14 @@ async def call_api(plugin, image_bytes_list: List[bytes], prompt: str) -> str:
         if is_chat_api:
             messages = []
             content: List[Dict[str, Any]] = [{"type": "text", "text": prompt}]
-            if image_bytes_list:
-                appended = 0
-                for idx, img_bytes in enumerate(image_bytes_list, start=1):
-                    try:
-                        img_b64 = base64.b64encode(img_bytes).decode("utf-8")
-                        content.append(
-                            {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{img_b64}"}}
-                        )
-                        appended += 1
-                    except Exception as exc:
-                        logger.error(f"Base64 编码第 {idx} 张图片时出错: {exc}", exc_info=True)
-                if appended == 0:
-                    logger.warning("收到图像输入但全部编码失败，已回退为纯文本请求")
+            for image_uri in image_uris:
+                content.append({"type": "image_url", "image_url": {"url": image_uri}})
             messages.append({"role": "user", "content": content})
 
             payload = {
                 "model": model_name,
                 "messages": messages,
-                "stream": False,
+                "stream": bool(plugin.conf.get("openai_stream", False)),
             }
         else:
             payload = {
@@ -410,18 +925,13 @@ async def call_api(plugin, image_bytes_list: List[bytes], prompt: str) -> str:
                 "size": plugin.conf.get("image_size", "1024x1024"),
                 "response_format": "url",
             }
-            if image_bytes_list:
-                try:
-                    if len(image_bytes_list) > 1:
-                        logger.info(
-                            "OpenAI 图像生成端点暂不支持多图输入，已仅使用第一张 (共 %d 张)",
-                            len(image_bytes_list),
-                        )
-                    img_b64 = base64.b64encode(image_bytes_list[0]).decode("utf-8")
-                    payload["image"] = f"data:image/png;base64,{img_b64}"
-                except Exception as e:
-                    logger.error(f"Base64 编码图片时出错: {e}", exc_info=True)
-                    return f"图片编码失败: {e}"
+            if image_uris:
+                if len(image_bytes_list) > 1:
+                    logger.info(
+                        "OpenAI 图像生成端点暂不支持多图输入，已仅使用第一张 (共 %d 张)",
+                        len(image_bytes_list),
+                    )
+                payload["image"] = image_uris[0]
     else:
         return f"未知的 API 类型: {api_type}"
 
@@ -432,67 +942,232 @@ async def call_api(plugin, image_bytes_list: List[bytes], prompt: str) -> str:
         model_name,
         bool(image_bytes_list),
     )
+    return payload
 
-    try:
-        if not plugin.iwf:
-            return "ImageWorkflow 未初始化"
-        async with plugin.iwf.session.post(
-            api_url, json=payload, headers=headers, proxy=plugin.iwf.proxy, timeout=120
-        ) as resp:
-            if resp.status != 200:
-                error_text = await resp.text()
-                logger.error(f"API 请求失败: HTTP {resp.status}, 响应: {error_text}")
-                return f"API请求失败 (HTTP {resp.status}): {error_text[:200]}"
 
-            data = await resp.json()
-            gen_image_url = None
+def extract_chat_image_url(content: str, complete: bool = True) -> str | None:
+    match = re.search(r"!\[.*?\]\((.*?)\)", content)
+    if match:
+        return match.group(1)
+    if complete:
+        url_match = re.search(r"(https?://[^\s)]+)", content)
+        if url_match:
+            return url_match.group(1)
+        if content.strip().startswith("http"):
+            return content.strip()
+        return None
+    url_match = re.search(r"(https?://[^\s)]+)[\s)]", content)
+    return url_match.group(1) if url_match else None
 
-            if api_type == "openai" and "chat/completions" in api_url:
-                try:
-                    content = data["choices"][0]["message"]["content"]
-                    match = re.search(r"!\[.*?\]\((.*?)\)", content)
-                    if match:
-                        gen_image_url = match.group(1)
-                    elif "http" in content:
-                        url_match = re.search(r"(https?://[^\s)]+)", content)
-                        if url_match:
-                            gen_image_url = url_match.group(1)
-                    if not gen_image_url:
-                        if content.strip().startswith("http"):
-                            gen_image_url = content.strip()
-                        else:
-                            logger.warning(f"无法从Chat响应中提取图片URL，将返回原始content: {content}")
-                            return content
-                    return gen_image_url
-                except (KeyError, IndexError, TypeError) as e:
-                    logger.error(f"解析Chat响应结构失败: {data}", exc_info=True)
-                    return f"解析Chat响应失败: {str(data)[:200]}"
-            else:
-                if "data" not in data or not data["data"]:
-                    logger.error(f"API响应中未找到图片数据: {data}")
-                    if "error" in data:
-                        if isinstance(data["error"], dict):
-                            return data["error"].get("message", json.dumps(data["error"]))
-                        return str(data["error"])
-                    return f"API响应中未找到图片数据: {str(data)[:500]}..."
 
-                gen_image_url = extract_image_url_from_response(plugin, data)
+async def _read_chat_stream(plugin, api_url: str, resp: aiohttp.ClientResponse, started: float) -> str:
+    if "text/event-stream" not in resp.headers.get("Content-Type", ""):
+        data = await resp.json(content_type=None)
+        return _parse_api_response(plugin, "openai", api_url, data)
 
-            if not gen_image_url:
-                logger.error(f"API响应解析失败: {data}")
-                return f"API响应解析失败: {str(data)[:500]}..."
+    content = ""
+    async for raw_line in resp.content:
+        line = raw_line.decode("utf-8", "ignore").strip()
+        if not line.startswith("data:"):
+            continue
+        chunk = line[5:].strip()
+        if chunk == "[DONE]":
+            break
+        try:
+            event_data = json.loads(chunk)
+        except json.JSONDecodeError:
+            continue
+        if "error" in event_data:
+            error = event_data["error"]
+            return error.get("message", json.dumps(error)) if isinstance(error, dict) else str(error)
+        for choice in event_data.get("choices") or []:
+            content += (choice.get("delta") or {}).get("content") or ""
+        gen_image_url = extract_chat_image_url(content, complete=False)
+        if gen_image_url:
+            first_url = time.monotonic() - started
+            plugin.generation.stream_first_url.add(first_url)
+            logger.info(f"流式响应在 {first_url:.2f}s 时得到图片 URL，提前结束读取")
+            resp.close()
+            return gen_image_url
+
+    gen_image_url = extract_chat_image_url(content)
+    if gen_image_url:
+        plugin.generation.stream_first_url.add(time.monotonic() - started)
+        return gen_image_url
+    logger.warning(f"无法从流式Chat响应中提取图片URL，将返回原始content: {content[:500]}")
+    return content or "流式响应为空"
 
+
+def _parse_api_response(plugin, api_type: str, api_url: str, data: Dict[str, Any]) -> str:
+    if api_type == "openai" and "chat/completions" in api_url:
+        try:
+            content = data["choices"][0]["message"]["content"]
+            gen_image_url = extract_chat_image_url(content)
+            if not gen_image_url:
+                logger.warning(f"无法从Chat响应中提取图片URL，将返回原始content: {content}")
+                return content
             return gen_image_url
+        except (KeyError, IndexError, TypeError):
+            logger.error(f"解析Chat响应结构失败: {data}", exc_info=True)
+            return f"解析Chat响应失败: {str(data)[:200]}"
 
+    if "data" not in data or not data["data"]:
+        logger.error(f"API响应中未找到图片数据: {data}")
+        if "error" in data:
+            if isinstance(data["error"], dict):
+                return data["error"].get("message", json.dumps(data["error"]))
+            return str(data["error"])
+        return f"API响应中未找到图片数据: {str(data)[:500]}..."
+
+    gen_image_urls = extract_image_urls(plugin, data)
+    if not gen_image_urls:
+        logger.error(f"API响应解析失败: {data}")
+        return f"API响应解析失败: {str(data)[:500]}..."
+    return "\n".join(gen_image_urls)
+
+
+async def _post_once(
+    plugin, api_type: str, api_url: str, payload: Dict[str, Any], used_keys: List[str]
+) -> ApiAttempt:
+    keys = backend_keys(plugin, api_type)
+    api_key = plugin.key_scheduler.acquire(keys, exclude=used_keys) or plugin.key_scheduler.acquire(keys)
+    if not api_key:
+        if keys:
+            return ApiAttempt("所有 API Key 均处于冷却或隔离状态，请稍后再试", False, backend_error=True, sent=False)
+        return ApiAttempt("无可用的 API Key", False, backend_error=True, sent=False)
+    used_keys.append(api_key)
+    headers = {"Content-Type": "application/json", "Authorization": f"Bearer {api_key}"}
+    timeouts = plugin.backends.timeouts
+    latency_key = (api_type, str(payload.get("model") or ""), str(payload.get("size") or "-"))
+
+    started = time.monotonic()
+    status: int | None = None
+    error: str | None = None
+    cancelled = False
+    try:
+        request = plugin.iwf.gen_session.post(
+            api_url,
+            json=payload,
+            headers=headers,
+            proxy=plugin.iwf.proxy,
+            timeout=timeouts.client_timeout(latency_key),
+        )
+        resp = await asyncio.wait_for(request, timeouts.timeouts(latency_key)["first_byte"])
+        async with resp:
+            first_byte = time.monotonic() - started
+            status = resp.status
+            if resp.status != 200:
+                error_text = await resp.text()
+                logger.error(f"API 请求失败: HTTP {resp.status}, 响应: {error_text}")
+                return ApiAttempt(
+                    f"API请求失败 (HTTP {resp.status}): {error_text[:200]}",
+                    False,
+                    resp.status in RETRYABLE_STATUSES,
+                    resp.status in KEY_ERROR_STATUSES,
+                )
+            if payload.get("stream") and "chat/completions" in api_url:
+                result = await _read_chat_stream(plugin, api_url, resp, started)
+            else:
+                data = await resp.json()
+                result = _parse_api_response(plugin, api_type, api_url, data)
+        if result.startswith("http"):
+            plugin.generation.latency.add(time.monotonic() - started)
+            timeouts.observe(latency_key, first_byte, time.monotonic() - started)
+        return ApiAttempt(result, result.startswith("http"))
+    except asyncio.CancelledError:
+        cancelled = True
+        raise
     except asyncio.TimeoutError:
+        error = "请求超时"
         logger.error("API 请求超时")
-        return "请求超时"
+        return ApiAttempt("请求超时", False, True)
+    except aiohttp.ClientConnectionError as e:
+        error = type(e).__name__
+        logger.error(f"调用 API 时连接异常: {e!r}")
+        return ApiAttempt(f"连接异常: {e}", False, True)
     except Exception as e:
+        error = type(e).__name__
         logger.error(f"调用 API 时发生未知错误: {e}", exc_info=True)
-        return f"发生未知错误: {e}"
+        return ApiAttempt(f"发生未知错误: {e}", False)
+    finally:
+        if cancelled:
+            plugin.key_scheduler.abandon(api_key)
+        else:
+            actions_key.release_api_key(plugin, api_key, status, time.monotonic() - started, error)
+
+
+def _hedge_delay(plugin) -> float | None:
+    if not plugin.conf.get("api_hedge_enabled", False):
+        return None
+    delay = conf_float(plugin.conf, "api_hedge_delay", 0.0, minimum=0.0)
+    if delay > 0:
+        return delay
+    return plugin.generation.latency.percentile(0.9)
+
+
+async def _post_hedged(
+    plugin, api_type: str, api_url: str, payload: Dict[str, Any], used_keys: List[str]
+) -> ApiAttempt:
+    first = asyncio.create_task(_post_once(plugin, api_type, api_url, payload, used_keys))
+    delay = _hedge_delay(plugin)
+    if delay is None:
+        return await first
+    done, _ = await asyncio.wait({first}, timeout=delay)
+    if done or len(used_keys) >= len(backend_keys(plugin, api_type)):
+        return await first
+
+    logger.info(f"首个请求超过 {delay:.1f}s 未返回, 使用另一个 Key 发起对冲请求")
+    plugin.generation.hedges += 1
+    second = asyncio.create_task(_post_once(plugin, api_type, api_url, payload, used_keys))
+    pending = {first, second}
+    failure: ApiAttempt | None = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                attempt = task.result()
+                if attempt.ok:
+                    if task is second:
+                        plugin.generation.hedge_wins += 1
+                    return attempt
+                if failure is None or attempt.retryable:
+                    failure = attempt
+        return failure
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def _post_with_retries(plugin, api_type: str, api_url: str, payload: Dict[str, Any]) -> ApiAttempt:
+    max_retries = conf_int(plugin.conf, "api_max_retries", 2, minimum=0)
+    backoff_base = conf_float(plugin.conf, "api_retry_backoff", 1.0, minimum=0.0)
+    keys = backend_keys(plugin, api_type)
+    used_keys: List[str] = []
+    attempt: ApiAttempt | None = None
+    for retry in range(max_retries + 1):
+        if retry:
+            ready_in = plugin.key_scheduler.ready_in(keys)
+            if ready_in is None or ready_in > RETRY_BACKOFF_CAP:
+                logger.warning(
+                    f"生成请求失败 ({attempt.text[:80]}), {RETRY_BACKOFF_CAP:.0f}s 内没有可用的 API Key，停止重试"
+                )
+                break
+            plugin.generation.retries += 1
+            delay = max(ready_in, random.uniform(0, min(RETRY_BACKOFF_CAP, backoff_base * 2**retry)))
+            logger.warning(f"生成请求失败 ({attempt.text[:80]}), {delay:.1f}s 后第 {retry} 次重试")
+            await asyncio.sleep(delay)
+        result = await _post_hedged(plugin, api_type, api_url, payload, used_keys)
+        if result.sent or attempt is None:
+            attempt = result
+        if result.ok or not result.retryable:
+            break
+    return attempt
 
 
 async def terminate(plugin) -> None:
+    await plugin.jobs.shutdown()
+    await plugin.generation.shutdown()
+    await actions_count.close_quota_store(plugin)
     if plugin.iwf:
         await plugin.iwf.terminate()
     logger.info("[FigurinePro] 插件已终止")
@@ -0,0 +1,249 @@
+import asyncio
+import functools
+import json
+import re
+import time
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+from astrbot import logger
+from astrbot.api.event import MessageChain
+from astrbot.core.message.components import Plain
+from astrbot.core.platform.astr_message_event import AstrMessageEvent
+
+from . import actions_image
+from .actions_admission import AdmissionTicket
+from .actions_config import conf_int
+from .actions_store import write_json_atomic
+
+JOB_STATUS_TEXT = {"queued": "排队中", "running": "生成中", "done": "已完成", "failed": "失败"}
+
+
+def _write_images(folder: Path, image_bytes_list: List[bytes]) -> None:
+    folder.mkdir(parents=True, exist_ok=True)
+    for index, data in enumerate(image_bytes_list):
+        (folder / f"{index}.bin").write_bytes(data)
+
+
+def _read_images(folder: Path, count: int) -> List[bytes]:
+    return [(folder / f"{index}.bin").read_bytes() for index in range(count)]
+
+
+def _remove_job_files(record: Path, folder: Path) -> None:
+    record.unlink(missing_ok=True)
+    if folder.exists():
+        for item in folder.iterdir():
+            item.unlink(missing_ok=True)
+        folder.rmdir()
+
+
+def _load_records(jobs_dir: Path) -> List[Dict[str, Any]]:
+    records = []
+    for path in jobs_dir.glob("*.json"):
+        try:
+            records.append(json.loads(path.read_text(encoding="utf-8")))
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning(f"读取任务记录失败 {path.name}: {e}")
+    return sorted(records, key=lambda job: job.get("created_at", 0))
+
+
+class JobManager:
+    def __init__(self, plugin, jobs_dir: Path):
+        self.plugin = plugin
+        self.jobs_dir = jobs_dir
+        self.jobs: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.tasks: Dict[str, asyncio.Task] = {}
+        self.held: Dict[str, List[AdmissionTicket]] = {}
+        self.completed = 0
+        self.failed = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.plugin.conf.get("enable_job_queue", True))
+
+    def _record_path(self, job_id: str) -> Path:
+        return self.jobs_dir / f"{job_id}.json"
+
+    def _image_dir(self, job_id: str) -> Path:
+        return self.jobs_dir / job_id
+
+    async def _save(self, job: Dict[str, Any]) -> None:
+        loop = asyncio.get_running_loop()
+        payload = json.dumps(job, ensure_ascii=False)
+        await loop.run_in_executor(None, write_json_atomic, self._record_path(job["id"]), payload)
+
+    async def submit(
+        self, spec: Dict[str, Any], image_bytes_list: List[bytes], fingerprints: List[str], umo: str
+    ) -> Tuple[Dict[str, Any], List[AdmissionTicket]]:
+        tickets = actions_image.enter_tickets(self.plugin, spec)
+        job = dict(spec)
+        job.update(
+            id=uuid.uuid4().hex[:8],
+            umo=umo,
+            fingerprints=fingerprints,
+            image_count=len(image_bytes_list),
+            status="queued",
+            created_at=time.time(),
+        )
+        try:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, functools.partial(self.jobs_dir.mkdir, parents=True, exist_ok=True))
+            if image_bytes_list:
+                await loop.run_in_executor(None, _write_images, self._image_dir(job["id"]), image_bytes_list)
+            await self._save(job)
+        except BaseException:
+            self._release(tickets)
+            raise
+        if job.get("reservation"):
+            job["reservation"]["job"] = job["id"]
+        self._start(job, tickets)
+        return job, tickets
+
+    def _release(self, tickets: List[AdmissionTicket]) -> None:
+        for ticket in tickets:
+            self.plugin.admission.release(ticket)
+
+    def _start(self, job: Dict[str, Any], tickets: List[AdmissionTicket]) -> None:
+        self.jobs[job["id"]] = job
+        self.held[job["id"]] = tickets
+        if tickets[0].admitted:
+            self._launch(job)
+        else:
+            tickets[0].future.add_done_callback(lambda future: self._admitted(job, future))
+
+    def _admitted(self, job: Dict[str, Any], future: asyncio.Future) -> None:
+        if not future.cancelled():
+            self._launch(job)
+
+    def _launch(self, job: Dict[str, Any]) -> None:
+        task = asyncio.create_task(self._run(job))
+        self.tasks[job["id"]] = task
+        task.add_done_callback(lambda _: self._finish(job["id"]))
+
+    def _finish(self, job_id: str) -> None:
+        self.tasks.pop(job_id, None)
+        self._release(self.held.pop(job_id, []))
+
+    async def _run(self, job: Dict[str, Any]) -> None:
+        tickets = self.held.pop(job["id"])
+        loop = asyncio.get_running_loop()
+        try:
+            image_bytes_list = await loop.run_in_executor(
+                None, _read_images, self._image_dir(job["id"]), job.get("image_count", 0)
+            )
+            await self.plugin.admission.wait(tickets[0])
+            job["status"] = "running"
+            job["started_at"] = time.time()
+            await self._save(job)
+            admitted, tickets = tickets, []
+            results, elapsed = await actions_image.run_batch(
+                self.plugin, job, image_bytes_list, job["fingerprints"], admitted
+            )
+            chain = await actions_image.build_result_chain(self.plugin, job, results, elapsed)
+            produced = [res for _, res in results if actions_image.result_urls(res)]
+            job["status"] = "done" if produced else "failed"
+            job["result"] = "\n".join(produced) if produced else results[0][1]
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"任务 {job['id']} 执行失败: {e}", exc_info=True)
+            job["status"] = "failed"
+            job["result"] = str(e)
+            chain = [Plain(f"❌ 任务 {job['id']} 执行失败: {e}")]
+            await self.plugin.ledger.settle(job.get("reservation"), 0)
+        finally:
+            self._release(tickets)
+        job["finished_at"] = time.time()
+        if job["status"] == "done":
+            self.completed += 1
+        else:
+            self.failed += 1
+        try:
+            await self.plugin.context.send_message(job["umo"], MessageChain(chain=chain))
+        except Exception as e:
+            logger.error(f"任务 {job['id']} 结果投递失败: {e}")
+        await loop.run_in_executor(None, _remove_job_files, self._record_path(job["id"]), self._image_dir(job["id"]))
+        self._trim()
+
+    def _trim(self) -> None:
+        keep = conf_int(self.plugin.conf, "job_history_size", 100, minimum=0)
+        finished = [job_id for job_id, job in self.jobs.items() if job["status"] in ("done", "failed")]
+        for job_id in finished[: max(0, len(finished) - keep)]:
+            del self.jobs[job_id]
+
+    async def resume(self) -> None:
+        if not self.jobs_dir.exists():
+            return
+        loop = asyncio.get_running_loop()
+        records = await loop.run_in_executor(None, _load_records, self.jobs_dir)
+        for job in records:
+            if job.get("status") not in ("queued", "running"):
+                continue
+            job["status"] = "queued"
+            tickets = actions_image.enter_tickets(self.plugin, dict(job, is_master=True), overflow=True)
+            self._start(job, tickets)
+        if records:
+            logger.info(f"FigurinePro: 已恢复 {len(self.active())} 个未完成的生成任务")
+
+    async def shutdown(self) -> None:
+        for tickets in self.held.values():
+            if tickets[0].future:
+                tickets[0].future.cancel()
+        tasks = list(self.tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        held, self.held = self.held, {}
+        for tickets in held.values():
+            self._release(tickets)
+
+    def active(self) -> List[Dict[str, Any]]:
+        return [job for job in self.jobs.values() if job["status"] in ("queued", "running")]
+
+
+def _describe_job(job: Dict[str, Any]) -> str:
+    status = JOB_STATUS_TEXT.get(job["status"], job["status"])
+    if job.get("batch"):
+        label = "/".join(item["preset"] for item in job["batch"])
+    else:
+        label = job.get("preset") or job["prompt"]
+    label = label[:20] + "..." if len(label) > 20 else label
+    line = f"#{job['id']} [{label}] {status}"
+    if job["status"] == "queued":
+        line += f" (已等待 {time.time() - job['created_at']:.0f}s)"
+    elif job["status"] == "running":
+        line += f" (已运行 {time.time() - job.get('started_at', job['created_at']):.0f}s)"
+    elif job["status"] == "failed" and not str(job.get("result", "")).startswith("http"):
+        line += f": {job.get('result', '')}"
+    return line
+
+
+async def job_status(plugin, event: AstrMessageEvent):
+    manager = plugin.jobs
+    sender_id = event.get_sender_id()
+    is_admin = plugin.is_global_admin(event)
+    match = re.search(r"\b([0-9a-f]{8})\b", event.message_str)
+    if match:
+        job = manager.jobs.get(match.group(1))
+        if not job or (job["sender_id"] != sender_id and not is_admin):
+            yield event.plain_result("未找到该任务。")
+            return
+        yield event.plain_result(_describe_job(job))
+        return
+
+    active = manager.active()
+    lines = [
+        "📋 生成任务队列",
+        f"进行中: {plugin.admission.running} | 排队: {plugin.admission.queued} | 未完成任务: {len(active)}",
+    ]
+    if is_admin:
+        lines.append(f"累计完成: {manager.completed} | 累计失败: {manager.failed}")
+    own = [job for job in manager.jobs.values() if job["sender_id"] == sender_id][-5:]
+    if own:
+        lines.append("您的任务:")
+        lines.extend(_describe_job(job) for job in own)
+    else:
+        lines.append("您当前没有任务。")
+    yield event.plain_result("\n".join(lines))
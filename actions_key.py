@@ -1,7 +1,139 @@
-from typing import Optional
+import time
+from typing import Any, Dict, Iterable, List, Mapping, Optional
 
+from astrbot import logger
 from astrbot.core.platform.astr_message_event import AstrMessageEvent
 
+from .actions_config import conf_float, conf_int
+
+LATENCY_EWMA_ALPHA = 0.3
+AUTH_ERROR_STATUSES = {401, 403}
+BALANCE_ERROR_STATUSES = {402}
+
+
+class KeyHealth:
+    def __init__(self):
+        self.in_flight = 0
+        self.latency: float | None = None
+        self.successes = 0
+        self.failures = 0
+        self.consecutive_429 = 0
+        self.cooldown_until = 0.0
+        self.quarantined_until = 0.0
+        self.last_error: str | None = None
+
+    def available(self, now: float) -> bool:
+        return self.cooldown_until <= now and self.quarantined_until <= now
+
+    def state(self, now: float) -> str:
+        if self.quarantined_until > now:
+            return f"隔离中 ({self.quarantined_until - now:.0f}s)"
+        if self.cooldown_until > now:
+            return f"冷却中 ({self.cooldown_until - now:.0f}s)"
+        return "正常"
+
+
+class KeyScheduler:
+    def __init__(self, conf: Mapping[str, Any]):
+        self.conf = conf
+        self.health: Dict[str, KeyHealth] = {}
+        self._cursor = 0
+
+    def sync(self, keys: Iterable[str], prune: bool = True) -> None:
+        keys = list(keys)
+        for key in keys:
+            self.health.setdefault(key, KeyHealth())
+        if not prune:
+            return
+        for key in [k for k in self.health if k not in keys and not self.health[k].in_flight]:
+            del self.health[key]
+
+    def acquire(self, keys: List[str], exclude: Iterable[str] = (), reserve: bool = True) -> str | None:
+        self.sync(keys, prune=False)
+        now = time.monotonic()
+        excluded = set(exclude)
+        per_key = conf_int(self.conf, "max_concurrent_per_key", 0, minimum=0)
+        candidates = [
+            k
+            for k in keys
+            if k not in excluded
+            and self.health[k].available(now)
+            and (not per_key or self.health[k].in_flight < per_key)
+        ]
+        if not candidates:
+            return None
+        self._cursor = (self._cursor + 1) % len(candidates)
+        rotated = candidates[self._cursor :] + candidates[: self._cursor]
+        key = min(rotated, key=lambda k: (self.health[k].in_flight, self.health[k].latency or 0.0))
+        if reserve:
+            self.health[key].in_flight += 1
+        return key
+
+    def ready_in(self, keys: List[str]) -> float | None:
+        self.sync(keys, prune=False)
+        now = time.monotonic()
+        waits = [max(self.health[k].cooldown_until, self.health[k].quarantined_until) - now for k in keys]
+        return max(0.0, min(waits)) if waits else None
+
+    def capacity(self, keys: List[str]) -> int | None:
+        per_key = conf_int(self.conf, "max_concurrent_per_key", 0, minimum=0)
+        if not per_key:
+            return None
+        self.sync(keys, prune=False)
+        now = time.monotonic()
+        return per_key * sum(1 for k in keys if self.health[k].available(now))
+
+    def release(self, key: str, status: int | None, latency: float, error: str | None = None) -> None:
+        health = self.health.get(key)
+        if health is None:
+            return
+        health.in_flight = max(0, health.in_flight - 1)
+        now = time.monotonic()
+        if status == 200:
+            health.successes += 1
+            health.consecutive_429 = 0
+            health.latency = (
+                latency
+                if health.latency is None
+                else LATENCY_EWMA_ALPHA * latency + (1 - LATENCY_EWMA_ALPHA) * health.latency
+            )
+            return
+
+        health.failures += 1
+        masked = f"{key[:8]}..."
+        if status == 429:
+            base = conf_float(self.conf, "key_cooldown_base", 5.0, minimum=0.1)
+            cap = conf_float(self.conf, "key_cooldown_max", 300.0, minimum=base)
+            cooldown = min(cap, base * 2**health.consecutive_429)
+            health.consecutive_429 += 1
+            health.cooldown_until = now + cooldown
+            health.last_error = "429 限流"
+            logger.warning(f"API Key {masked} 被限流, 冷却 {cooldown:.0f}s")
+        elif status in AUTH_ERROR_STATUSES or status in BALANCE_ERROR_STATUSES:
+            quarantine = conf_int(self.conf, "key_quarantine_seconds", 1800, minimum=1)
+            health.quarantined_until = now + quarantine
+            health.last_error = f"{status} {'鉴权失败' if status in AUTH_ERROR_STATUSES else '余额不足'}"
+            logger.warning(f"API Key {masked} 返回 HTTP {status}, 隔离 {quarantine}s")
+        else:
+            health.last_error = error or (f"HTTP {status}" if status else "请求异常")
+
+    def abandon(self, key: str) -> None:
+        if health := self.health.get(key):
+            health.in_flight = max(0, health.in_flight - 1)
+
+    def describe(self, key: str) -> str:
+        health = self.health.get(key) or KeyHealth()
+        latency = f"{health.latency:.1f}s" if health.latency is not None else "-"
+        parts = [
+            health.state(time.monotonic()),
+            f"进行中 {health.in_flight}",
+            f"成功 {health.successes}/失败 {health.failures}",
+            f"延迟 {latency}",
+        ]
+        if health.last_error:
+            parts.append(f"最近错误: {health.last_error}")
+        return " | ".join(parts)
+
 
 async def add_key(plugin, event: AstrMessageEvent):
     if not plugin.is_global_admin(event):
@@ -20,12 +152,24 @@ async def add_key(plugin, event: AstrMessageEvent):
 async def list_keys(plugin, event: AstrMessageEvent):
     if not plugin.is_global_admin(event):
         return
-    api_keys = plugin.conf.get("api_keys", [])
-    if not api_keys:
+    if not configured_keys(plugin):
         yield event.plain_result("📝 暂未配置任何 API Key。")
         return
-    key_list_str = "\n".join(f"{i + 1}. {key[:8]}...{key[-4:]}" for i, key in enumerate(api_keys))
-    yield event.plain_result(f"🔑 API Key 列表:\n{key_list_str}")
+    plugin.key_scheduler.sync(configured_keys(plugin))
+    groups = [
+        ("通用 (api_keys)", plugin.conf.get("api_keys", [])),
+        ("volcengine 专用", plugin.conf.get("volcengine_api_keys") or []),
+        ("openai 专用", plugin.conf.get("openai_api_keys") or []),
+    ]
+    lines = ["🔑 API Key 列表:"]
+    for label, keys in groups:
+        if not keys:
+            continue
+        lines.append(f"[{label}]")
+        lines.extend(
+            f"{i + 1}. {key[:8]}...{key[-4:]}\n   {plugin.key_scheduler.describe(key)}" for i, key in enumerate(keys)
+        )
+    yield event.plain_result("\n".join(lines))
 
 
 async def delete_key(plugin, event: AstrMessageEvent):
@@ -44,11 +188,21 @@ async def delete_key(plugin, event: AstrMessageEvent):
         yield event.plain_result("格式错误，请使用 #手办化删除key <序号|all>")
 
 
+def configured_keys(plugin) -> List[str]:
+    keys = [
+        *plugin.conf.get("api_keys", []),
+        *(plugin.conf.get("volcengine_api_keys") or []),
+        *(plugin.conf.get("openai_api_keys") or []),
+    ]
+    return list(dict.fromkeys(keys))
+
+
 async def get_api_key(plugin) -> Optional[str]:
     keys = plugin.conf.get("api_keys", [])
     if not keys:
         return None
-    async with plugin.key_lock:
-        key = keys[plugin.key_index]
-        plugin.key_index = (plugin.key_index + 1) % len(keys)
-        return key
+    return plugin.key_scheduler.acquire(keys, reserve=False)
+
+
+def release_api_key(plugin, key: str, status: int | None, latency: float, error: str | None = None) -> None:
+    plugin.key_scheduler.release(key, status, latency, error)
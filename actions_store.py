@@ -0,0 +1,180 @@
+import asyncio
+import json
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, Mapping, Set
+
+from astrbot import logger
+
+
+class QuotaStore:
+    def __init__(self, path: Path):
+        self.path = path
+        self.conn: sqlite3.Connection | None = None
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="figurine-quota")
+        self.writes = 0
+
+    async def _run(self, func: Callable[..., Any], *args: Any) -> Any:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, func, *args)
+
+    def _open_sync(self) -> None:
+        self.conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS counts ("
+            "kind TEXT NOT NULL, id TEXT NOT NULL, count INTEGER NOT NULL, PRIMARY KEY (kind, id))"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS daily_checkins ("
+            "day TEXT NOT NULL, user_id TEXT NOT NULL, streak INTEGER NOT NULL, PRIMARY KEY (day, user_id))"
+        )
+        legacy = self.conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'checkins'")
+        if legacy.fetchone():
+            self.conn.execute(
+                "INSERT OR IGNORE INTO daily_checkins (day, user_id, streak) SELECT day, user_id, 1 FROM checkins"
+            )
+            self.conn.execute("DROP TABLE checkins")
+        self.conn.commit()
+
+    async def open(self) -> None:
+        await self._run(self._open_sync)
+        logger.info(f"次数数据使用 SQLite 存储: {self.path}")
+
+    def _load_counts_sync(self, kind: str) -> Dict[str, int]:
+        rows = self.conn.execute("SELECT id, count FROM counts WHERE kind = ?", (kind,))
+        return {user_id: count for user_id, count in rows}
+
+    async def load_counts(self, kind: str) -> Dict[str, int]:
+        return await self._run(self._load_counts_sync, kind)
+
+    def _set_counts_sync(self, kind: str, values: Mapping[str, int]) -> None:
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO counts (kind, id, count) VALUES (?, ?, ?) "
+                "ON CONFLICT (kind, id) DO UPDATE SET count = excluded.count",
+                [(kind, str(key), int(value)) for key, value in values.items()],
+            )
+
+    async def set_counts(self, kind: str, values: Mapping[str, int]) -> None:
+        if values:
+            await self._run(self._set_counts_sync, kind, dict(values))
+            self.writes += 1
+
+    def _load_checkins_sync(self, day: str) -> Dict[str, int]:
+        rows = self.conn.execute("SELECT user_id, streak FROM daily_checkins WHERE day = ?", (day,))
+        return {user_id: streak for user_id, streak in rows}
+
+    async def load_checkins(self, day: str) -> Dict[str, int]:
+        return await self._run(self._load_checkins_sync, day)
+
+    def _set_checkins_sync(self, day: str, values: Mapping[str, int]) -> None:
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO daily_checkins (day, user_id, streak) VALUES (?, ?, ?) "
+                "ON CONFLICT (day, user_id) DO UPDATE SET streak = excluded.streak",
+                [(day, str(key), int(value)) for key, value in values.items()],
+            )
+
+    async def set_checkins(self, day: str, values: Mapping[str, int]) -> None:
+        if values:
+            await self._run(self._set_checkins_sync, day, dict(values))
+            self.writes += 1
+
+    def _prune_checkins_sync(self, oldest_day: str) -> None:
+        with self.conn:
+            self.conn.execute("DELETE FROM daily_checkins WHERE day < ?", (oldest_day,))
+
+    async def prune_checkins(self, oldest_day: str) -> None:
+        await self._run(self._prune_checkins_sync, oldest_day)
+
+    def _close_sync(self) -> None:
+        if self.conn:
+            self.conn.close()
+            self.conn = None
+
+    async def close(self) -> None:
+        await self._run(self._close_sync)
+        self.executor.shutdown(wait=False)
+
+
+def write_json_atomic(path: Path, payload: str) -> int:
+    data = payload.encode("utf-8")
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    return len(data)
+
+
+class SnapshotWriter:
+    def __init__(self, path: Path, source: Callable[[], Dict[str, Any]], interval: float, max_changes: int):
+        self.path = path
+        self.source = source
+        self.interval = interval
+        self.max_changes = max_changes
+        self.dirty = 0
+        self.flushes = 0
+        self.bytes_written = 0
+        self.flush_seconds = 0.0
+        self.last_flush_latency = 0.0
+        self._lock = asyncio.Lock()
+        self._timer: asyncio.Task | None = None
+        self._pending: Set[asyncio.Task] = set()
+
+    def mark_dirty(self) -> None:
+        self.dirty += 1
+        if self.dirty >= self.max_changes:
+            task = asyncio.create_task(self.flush())
+            self._pending.add(task)
+            task.add_done_callback(self._pending.discard)
+        elif self._timer is None:
+            self._timer = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self) -> None:
+        try:
+            await asyncio.sleep(self.interval)
+        finally:
+            self._timer = None
+        await self.flush()
+
+    async def flush(self) -> None:
+        async with self._lock:
+            if not self.dirty:
+                return
+            changes, self.dirty = self.dirty, 0
+            snapshot = dict(self.source())
+            started = time.monotonic()
+            loop = asyncio.get_running_loop()
+            try:
+                payload = await loop.run_in_executor(None, lambda: json.dumps(snapshot, ensure_ascii=False))
+                written = await loop.run_in_executor(None, write_json_atomic, self.path, payload)
+            except Exception as e:
+                self.dirty += changes
+                logger.error(f"写入快照 {self.path.name} 失败: {e}", exc_info=True)
+                return
+            self.last_flush_latency = time.monotonic() - started
+            self.flush_seconds += self.last_flush_latency
+            self.flushes += 1
+            self.bytes_written += written
+
+    async def close(self) -> None:
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        if self._pending:
+            await asyncio.gather(*self._pending, return_exceptions=True)
+        await self.flush()
+
+    def describe(self) -> str:
+        average = self.flush_seconds / self.flushes * 1000 if self.flushes else 0.0
+        return (
+            f"{self.path.name}: 落盘 {self.flushes} 次, 写入 {self.bytes_written / 1024:.1f} KB, "
+            f"平均 {average:.1f} ms, 最近 {self.last_flush_latency * 1000:.1f} ms, 待写 {self.dirty}"
+        )
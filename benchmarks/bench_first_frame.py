@@ -0,0 +1,76 @@
+"""Micro-benchmark: header probe fast path vs. full PIL decode in first-frame extraction.
+
+Run inside the AstrBot environment (the plugin modules import ``astrbot``):
+
+    python benchmarks/bench_first_frame.py [--rounds 200] [extra images ...]
+"""
+
+import argparse
+import importlib
+import io
+import random
+import sys
+import time
+import types
+from pathlib import Path
+
+from PIL import Image as PILImage
+
+PLUGIN_DIR = Path(__file__).resolve().parent.parent
+
+
+def load_codec():
+    package = types.ModuleType("figurine_plugin")
+    package.__path__ = [str(PLUGIN_DIR)]
+    sys.modules["figurine_plugin"] = package
+    return importlib.import_module("figurine_plugin.actions_codec")
+
+
+def encode(frames, fmt, **kwargs) -> bytes:
+    out_io = io.BytesIO()
+    frames[0].save(out_io, format=fmt, save_all=len(frames) > 1, append_images=frames[1:], **kwargs)
+    return out_io.getvalue()
+
+
+def build_corpus(extra_paths):
+    rng = random.Random(0)
+    photo = PILImage.frombytes("RGB", (2048, 1536), rng.randbytes(2048 * 1536 * 3))
+    frames = [PILImage.new("RGB", (480, 480), (i * 40, 80, 160)) for i in range(6)]
+    corpus = {
+        "photo.jpg (2048x1536)": encode([photo], "JPEG", quality=90),
+        "photo.png (2048x1536)": encode([photo], "PNG"),
+        "photo.webp (2048x1536)": encode([photo], "WEBP", quality=90),
+        "static.gif": encode(frames[:1], "GIF"),
+        "animated.gif (6f)": encode(frames, "GIF", duration=100, loop=0),
+        "animated.png (APNG 6f)": encode(frames, "PNG", duration=100),
+        "animated.webp (6f)": encode(frames, "WEBP", duration=100),
+    }
+    for path in [*sorted((PLUGIN_DIR / "images").glob("*.png")), *map(Path, extra_paths)]:
+        corpus[path.name] = path.read_bytes()
+    return corpus
+
+
+def bench(func, data: bytes, rounds: int) -> float:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        func(data)
+    return (time.perf_counter() - start) / rounds * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rounds", type=int, default=200)
+    parser.add_argument("images", nargs="*", help="additional sample images")
+    args = parser.parse_args()
+
+    codec = load_codec()
+    print(f"{'sample':<28}{'size':>10}{'animated':>10}{'full (us)':>12}{'fast (us)':>12}{'speedup':>9}")
+    for name, data in build_corpus(args.images).items():
+        full = bench(codec.extract_first_frame_full, data, args.rounds)
+        fast = bench(codec.extract_first_frame, data, args.rounds)
+        animated = codec.probe_animation(data)
+        print(f"{name:<28}{len(data) // 1024:>8}KB{str(animated):>10}{full:>12.1f}{fast:>12.1f}{full / fast:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,18 @@
-import asyncio
 from typing import Any, Dict, List, Optional
 
-from . import actions_count, actions_help, actions_image, actions_key, actions_prompt
+from . import (
+    actions_admission,
+    actions_backend,
+    actions_cache,
+    actions_count,
+    actions_generate,
+    actions_help,
+    actions_image,
+    actions_job,
+    actions_key,
+    actions_prompt,
+    actions_store,
+)
 from astrbot.api.event import filter
 from astrbot.api.star import Context, Star, register, StarTools
 from astrbot.core import AstrBotConfig
@@ -25,10 +36,19 @@ class FigurineProPlugin(Star):
         self.group_counts_file = self.plugin_data_dir / "group_counts.json"
         self.group_counts: Dict[str, int] = {}
         self.user_checkin_file = self.plugin_data_dir / "user_checkin.json"
-        self.user_checkin_data: Dict[str, str] = {}
+        self.checkins = actions_count.CheckinBook()
+        self.quota_store: Optional[actions_store.QuotaStore] = None
+        self.snapshots: Dict[str, actions_store.SnapshotWriter] = {}
+        self.ledger = actions_count.QuotaLedger(self)
         self.prompt_map: Dict[str, str] = {}
-        self.key_index = 0
-        self.key_lock = asyncio.Lock()
+        self.key_scheduler = actions_key.KeyScheduler(config)
+        self.admission = actions_admission.AdmissionScheduler(
+            config,
+            lambda: actions_image.chain_capacity(self),
+        )
+        self.backends = actions_backend.BackendRouter(config)
+        self.generation = actions_generate.GenerationCache(config)
+        self.jobs = actions_job.JobManager(self, self.plugin_data_dir / "jobs")
         self.iwf: Optional[FigurineProPlugin.ImageWorkflow] = None
 
     async def initialize(self):
@@ -90,8 +110,8 @@ class FigurineProPlugin(Star):
     def _get_user_count(self, user_id: str) -> int:
         return actions_count.get_user_count(self, user_id)
 
-    async def _decrease_user_count(self, user_id: str):
-        await actions_count.decrease_user_count(self, user_id)
+    async def _decrease_user_count(self, user_id: str, amount: int = 1):
+        await actions_count.decrease_user_count(self, user_id, amount)
 
     async def _load_group_counts(self):
         await actions_count.load_group_counts(self)
@@ -102,8 +122,8 @@ class FigurineProPlugin(Star):
     def _get_group_count(self, group_id: str) -> int:
         return actions_count.get_group_count(self, group_id)
 
-    async def _decrease_group_count(self, group_id: str):
-        await actions_count.decrease_group_count(self, group_id)
+    async def _decrease_group_count(self, group_id: str, amount: int = 1):
+        await actions_count.decrease_group_count(self, group_id, amount)
 
     async def _load_user_checkin_data(self):
         await actions_count.load_user_checkin_data(self)
@@ -121,6 +141,16 @@ class FigurineProPlugin(Star):
         async for result in actions_count.add_user_counts(self, event):
             yield result
 
+    @filter.command("手办化批量增加次数", prefix_optional=True)
+    async def on_bulk_add_user_counts(self, event: AstrMessageEvent):
+        async for result in actions_count.bulk_user_counts(self, event, "add"):
+            yield result
+
+    @filter.command("手办化批量设置次数", prefix_optional=True)
+    async def on_bulk_set_user_counts(self, event: AstrMessageEvent):
+        async for result in actions_count.bulk_user_counts(self, event, "set"):
+            yield result
+
     @filter.command("手办化增加群组次数", prefix_optional=True)
     async def on_add_group_counts(self, event: AstrMessageEvent):
         async for result in actions_count.add_group_counts(self, event):
@@ -146,6 +176,21 @@ class FigurineProPlugin(Star):
         async for result in actions_key.delete_key(self, event):
             yield result
 
+    @filter.command("手办化任务", prefix_optional=True)
+    async def on_job_status(self, event: AstrMessageEvent):
+        async for result in actions_job.job_status(self, event):
+            yield result
+
+    @filter.command("手办化后端状态", prefix_optional=True)
+    async def on_backend_status(self, event: AstrMessageEvent):
+        async for result in actions_backend.backend_status(self, event):
+            yield result
+
+    @filter.command("手办化缓存统计", prefix_optional=True)
+    async def on_cache_stats(self, event: AstrMessageEvent):
+        async for result in actions_cache.cache_stats(self, event):
+            yield result
+
     async def _get_api_key(self) -> str | None:
         return await actions_key.get_api_key(self)
 